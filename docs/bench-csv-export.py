@@ -0,0 +1,89 @@
+#!/usr/bin/env micropython
+
+# Benchmark for CSV data export encoding, comparing it against older
+#  float/str-formatting encoder, and checking output values against samples.
+# Runs with micropython unix port, with output sent to a byte-counting stub.
+# Usage: micropython docs/bench-csv-export.py [counts...]
+# Example: micropython docs/bench-csv-export.py 1000 10000 65000
+
+import sys, time, gc
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0] if __file__.count('/') > 1 else '.')
+import main
+
+try: import uasyncio as asyncio
+except ImportError: import asyncio
+
+
+class Output:
+	def __init__(self, keep=False): self.bs, self.data = 0, keep and bytearray()
+	def write(self, buff):
+		self.bs += len(buff)
+		if self.data is not False: self.data.extend(buff)
+	async def drain(self): pass
+
+async def csv_old(req):
+	# Encoder used before v/10^dp integer formatting, with minor adjustments
+	header = b'time_offset, pm10, pm25, pm40, pm100, rh, t, voc, nox\n'
+	line_base = ( b' 123456.0, 123.0, 123.0,'
+		b' 123.0, 123.0, 12.34, 12.345, 1234.0, 1234.0\n' )
+	(line := req.buff[:len(line_base)])[:] = line_base
+	req.sout.write(header)
+	fields = (0,9),(10,6),(17,6),(24,6),(31,6),(38,6),(45,7),(53,7),(61,7)
+	fmt = dict((vlen, f'{{:>{vlen}}}') for pos,vlen in fields)
+	ts_now = req.srb.data_age() / 1000 # for offsets from the latest sample
+	for n, (ts, sample) in enumerate(req.srb.data_samples(ts_now)):
+		vals = (abs(ts),) + sample
+		for v, (pos, vlen) in zip(vals, fields):
+			if v is None: vs = b''
+			else:
+				vs = str(float(v))[:vlen]
+				if '.' not in vs: raise ValueError(v)
+				vs = vs.rstrip('.').encode()
+			line[pos:pos+vlen] = fmt[vlen].format(vs).encode()
+		req.sout.write(line)
+		if not n % 20: await req.sout.drain()
+
+async def csv_new(webui, req):
+	req.sout.write(b'\r\n\r\n') # to strip headers
+	await webui.req_data_csv(req)
+	if isinstance(req.sout.data, bytearray):
+		req.sout.data[:] = req.sout.data[req.sout.data.rindex(b'\r\n\r\n')+4:]
+
+
+def srb_fill(count, td_ms=60_123): # non-round time offsets
+	srb = main.SampleRingBuffer(td_ms, count)
+	for n in range(count):
+		struct_vals = ( n % 3000, n % 2000 + 1, n % 1000 + 7, n * 7 % 6000,
+			n * 13 % 10000 - 1000, n * 11 % 12000 - 4000, n % 500 * 10, 0x7fff )
+		main.struct.pack_into(srb.s_fmt, srb.sample_mv(ts := n * td_ms), 0, *struct_vals)
+		srb.sample_mv_commit(ts)
+	return srb
+
+def csv_check(srb, data):
+	lines = data.split(b'\n')[1:-1]
+	if len(lines) != srb.data_samples_count(): return f'line count {len(lines)}'
+	for line, (ts, sample) in zip(lines, srb.data_samples()):
+		for v, vs in zip(sample, line.split(b',')[1:]):
+			if (v is None) != (not vs.strip()) or (v is not None and abs(v - float(vs)) > 1e-6):
+				return f'{v} != {vs} in line {line}'
+
+def bench(func, srb, check=False):
+	req = main.WebUI.Req( verb=b'get', proto=b'HTTP/1.0', log=None, # no chunked encoding
+		srb=srb, buff=memoryview(bytearray(2048)), sout=Output(check) )
+	gc.collect()
+	ts = time.ticks_ms()
+	asyncio.run(func(req))
+	return time.ticks_diff(time.ticks_ms(), ts), req.sout
+
+
+counts = list(map(int, sys.argv[1:] or [1_000, 10_000, 65_000]))
+webui = main.WebUI(main.SampleRingBuffer(1000, 2))
+print(f'{"samples":>8s} {"csv-KiB":>8s} {"old-ms":>8s} {"new-ms":>8s} {"speedup":>8s}')
+for count in counts:
+	srb, check = srb_fill(count), count <= 1000
+	ms_old, out_old = bench(csv_old, srb, check)
+	ms_new, out_new = bench(lambda req: csv_new(webui, req), srb, check)
+	if check and (err := csv_check(srb, out_new.data)): print(f'Output mismatch: {err}')
+	print( f'{count:>8d} {out_new.bs/1024:>8.1f} {ms_old:>8d}'
+		f' {ms_new:>8d} {ms_old/max(1, ms_new):>7.1f}x' )
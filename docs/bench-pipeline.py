@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# Micro-benchmarks for sample pipeline hot paths in main.py - from SEN5x I2C reads
+#  to ring buffers and data exports - reporting ops/s, bytes/s and allocations per op.
+# Runs with CPython (via docs/emulator.py stand-ins) or micropython unix port,
+#  where allocations are also measured, and needs a larger heap for biggest ring sizes.
+# Results can be saved to json file, and compared against ones from older code.
+#
+# Usage: bench-pipeline.py [-o results.json] [-c old-results.json] [-f filter] [sizes...]
+# Example: micropython -X heapsize=8M docs/bench-pipeline.py -o bench-new.json
+#          micropython -X heapsize=8M docs/bench-pipeline.py -c bench-new.json 1000 65535
+
+import sys, time, gc, json
+
+p_docs = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+sys.path.insert(0, p_docs); import emulator; emulator.install()
+sys.path.insert(0, p_docs + '/..'); import main
+
+cpython, asyncio = emulator.cpython, main.asyncio
+if cpython: ts_us, td_us = lambda: time.perf_counter() * 1e6, lambda ts: ts_us() - ts
+else: ts_us, td_us = time.ticks_us, lambda ts: time.ticks_diff(time.ticks_us(), ts)
+
+
+class Output:
+	def __init__(self): self.bs = 0
+	def write(self, buff): self.bs += len(buff)
+	async def drain(self): pass
+
+class I2CStub:
+	def __init__(self, rx): self.rx = rx
+	def writeto(self, addr, buff): pass
+	def readfrom_into(self, addr, buff): buff[:] = self.rx[:len(buff)]
+
+def coro_run(coro):
+	# Runs coroutine that doesn't need event loop, i.e. never awaits anything that blocks
+	try: coro.send(None)
+	except StopIteration as res: return res.value
+	raise RuntimeError('Unexpected async wait in benchmarked coroutine')
+
+def sample_vals(n):
+	return ( n % 3000, n % 2000 + 1, n % 1000 + 7, n * 7 % 6000,
+		n * 13 % 10000 - 1000, n * 11 % 12000 - 4000, n % 500 * 10, 0x7fff )
+
+def srb_fill(cls, size, count, td_ms=60_000, gaps=0):
+	srb, ts = cls(td_ms, size), 0
+	for n in range(count):
+		main.struct.pack_into(srb.s_fmt, srb.sample_mv(ts), 0, *sample_vals(n))
+		srb.sample_mv_commit(ts)
+		ts += td_ms if not gaps or n % gaps else 5 * td_ms
+	return srb, ts
+
+
+# Benchmark functions return run(n) callable, which does n ops and returns bytes processed
+
+def b_sen5x_crc(size):
+	sen5x = main.Sen5x(None)
+	rx = emulator.Sen5xSim(emulator.Clock(), main.Sen5x.cmd_map).crc_wrap(bytes(range(1, 17)))
+	cmd, delay, rx_bytes, rx_parser = main.Sen5x.cmd_map['data_read']
+	sen5x.bus, smv = I2CStub(rx), memoryview(bytearray(16))
+	def run(n):
+		for m in range(n): coro_run(sen5x._run(cmd, 0, 0, rx_bytes, None, smv))
+		return n * rx_bytes
+	return run
+
+def b_srb_commit(size, cls=main.SampleRingBuffer, gaps=0):
+	srb, ts = srb_fill(cls, size, size, gaps=gaps) # pre-filled to also reclaim old samples
+	vals = list(main.struct.pack(srb.s_fmt, *sample_vals(n)) for n in range(64))
+	def run(n, ts=ts):
+		for m in range(n):
+			srb.sample_mv(ts)[:] = vals[m % 64]
+			srb.sample_mv_commit(ts)
+			ts += srb.n_td if not gaps or m % gaps else 5 * srb.n_td
+		return n * srb.sbs
+	return run
+
+def b_srb_iter(size, cls=main.SampleRingBuffer, func='data_samples_raw'):
+	srb, ts = srb_fill(cls, size, size, gaps=97)
+	def run(n):
+		for m in range(n):
+			for sample in getattr(srb, func)(): pass
+		return n * srb.data_samples_count() * 24
+	return run, srb.data_samples_count()
+
+def b_webui_export(size, k='csv', cls=main.SampleRingBuffer, enc=b''):
+	srb, ts = srb_fill(cls, size, size, gaps=97)
+	webui, buff = main.WebUI(srb), memoryview(bytearray(2048))
+	handler = getattr(webui, f'req_data_{k}')
+	def run(n):
+		bs = 0
+		for m in range(n):
+			req = main.WebUI.Req( verb=b'get', proto=b'HTTP/1.1',
+				log=None, srb=srb, buff=buff, enc=enc, sout=(out := Output()) )
+			coro_run(handler(req)); webui.res_end(req); bs += out.bs
+		return bs
+	return run, srb.data_samples_count()
+
+def b_alerts(size, func='check'):
+	sample = main.struct.pack(main.SampleRingBuffer.s_fmt, *sample_vals(1234))
+	data, pkt = main.Sen5x.sample_parse(sample), sample + b'pm t rh'
+	if func == 'crc16':
+		def run(n):
+			for m in range(n): main.UDPAlerts.crc16(None, pkt)
+			return n * len(pkt)
+		return run
+	bounds = ((1, 'pm', -999.0, 999.0), (5, 't', -40.0, 80.0), (4, 'rh', 0.0, 100.0))
+	alerts = main.UDPAlerts(0, dict(), bounds) # sends nothing with these bounds
+	def run(n):
+		for m in range(n): alerts.check(data, sample)
+		return n * len(sample)
+	return run
+
+
+def benchmarks(sizes):
+	srb_p = main.SampleRingBufferPacked
+	yield 'sen5x_run_crc8', None, b_sen5x_crc, 2_000
+	yield 'alerts_crc16', None, lambda s: b_alerts(s, 'crc16'), 2_000
+	if main.socket: yield 'alerts_check', None, b_alerts, 2_000
+	for size in sizes:
+		yield 'srb_commit', size, b_srb_commit, 2_000
+		yield 'srb_commit_skips', size, lambda s: b_srb_commit(s, gaps=4), 2_000
+		yield 'srb_packed_commit', size, lambda s: b_srb_commit(s, srb_p), 2_000
+		yield 'srb_data_samples_raw', size, b_srb_iter, 1
+		yield 'srb_data_samples', size, lambda s: b_srb_iter(s, func='data_samples'), 1
+		yield 'srb_packed_data_samples_raw', size, lambda s: b_srb_iter(s, srb_p), 1
+		yield 'webui_export_csv', size, b_webui_export, 1
+		if main.WebUI.gzip_check(8):
+			yield 'webui_export_csv_gzip', size, lambda s: b_webui_export(s, enc=b'gzip'), 1
+		yield 'webui_export_bin', size, lambda s: b_webui_export(s, 'bin'), 1
+		yield 'webui_packed_export_bin', size, lambda s: b_webui_export(s, 'bin', srb_p), 1
+		yield 'webui_export_cols', size, lambda s: b_webui_export(s, 'cols'), 1
+		yield 'webui_packed_export_cols', size, lambda s: b_webui_export(s, 'cols', srb_p), 1
+
+def bench(func, n, ops_per_run=1, repeat=5):
+	# Returns (ops/s, bytes/s, allocated-bytes/op) for best of repeat runs
+	td_best = bs = None
+	for m in range(repeat):
+		gc.collect()
+		ts = ts_us(); bs = func(n); td = max(1, td_us(ts))
+		td_best = min(td_best or td, td)
+	allocs = None
+	if not cpython: # heap bytes allocated with gc disabled, on fewer ops
+		n_alloc = max(1, n // 10)
+		gc.collect(); gc.disable()
+		try: mem = gc.mem_alloc(); func(n_alloc); allocs = (gc.mem_alloc() - mem) / n_alloc
+		finally: gc.enable()
+		allocs /= ops_per_run
+	ops = n * ops_per_run
+	return ops * 1e6 / td_best, bs * 1e6 / td_best, allocs
+
+
+def main_bench(args):
+	res_file = cmp_file = filt = None
+	sizes, args = list(), list(args)
+	while args:
+		if (arg := args.pop(0)) == '-o': res_file = args.pop(0)
+		elif arg == '-c': cmp_file = args.pop(0)
+		elif arg == '-f': filt = args.pop(0)
+		elif arg in ['-h', '--help']: return print(open(__file__).read().split('\n\n')[1])
+		else: sizes.append(int(arg))
+	sizes = sizes or [1_000, 10_000, 65_535]
+	results_cmp = dict()
+	if cmp_file:
+		with open(cmp_file) as src: results_cmp = json.load(src)['results']
+
+	impl = f'{sys.implementation.name}-{".".join(map(str, sys.implementation.version[:3]))}'
+	print(f'Implementation: {impl}')
+	print( f'{"benchmark":<28s} {"size":>6s} {"ops/s":>12s}'
+		f' {"MiB/s":>8s} {"alloc/op":>9s}' + (f' {"vs-old":>8s}' if cmp_file else '') )
+	results = dict()
+	for name, size, bench_func, n in benchmarks(sizes):
+		if filt and filt not in name: continue
+		run, ops_per_run = bench_func(size), 1
+		if isinstance(run, tuple): run, ops_per_run = run
+		ops, bps, allocs = bench(run, n, ops_per_run)
+		k = f'{name}.{size or 0}'
+		results[k] = dict(ops=ops, bps=bps, allocs=allocs)
+		allocs = '-' if allocs is None else f'{allocs:.1f}'
+		line = f'{name:<28s} {size or "-":>6} {ops:>12,.0f} {bps/2**20:>8.2f} {allocs:>9s}'
+		if cmp_file:
+			res = results_cmp.get(k)
+			line += f' {(ops / res["ops"] - 1) * 100:>+7.1f}%' if res else f' {"-":>8s}'
+		print(line)
+		run = None; gc.collect()
+
+	if res_file:
+		with open(res_file, 'w') as dst:
+			json.dump(dict(impl=impl, ts=int(time.time()), results=results), dst)
+		print(f'Results saved to: {res_file}')
+
+if __name__ == '__main__': main_bench(sys.argv[1:])
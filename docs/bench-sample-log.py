@@ -0,0 +1,46 @@
+#!/usr/bin/env micropython
+
+# Benchmark for restoring samples from sample-log on boot, for different log sizes.
+# Runs with micropython unix port, using temporary directory in place of flash.
+# Usage: micropython docs/bench-sample-log.py [tmp-dir] [counts...]
+# Example: micropython docs/bench-sample-log.py /tmp/aqm-bench 1000 10000 65000
+
+import os, sys, time
+
+sys.path.insert(0, __file__.rsplit('/', 2)[0] if __file__.count('/') > 1 else '.')
+import main
+
+
+def log_clean(p):
+	try: files = os.listdir(p)
+	except OSError: return
+	for fn in files: os.remove(f'{p}/{fn}')
+
+def log_fill(p, count, td_ms=60_000):
+	slog = main.SampleLog(p, 64, 64 * 1024, 2**16)
+	sample, ts = bytearray(main.SampleRingBuffer.sbs), 0
+	for n in range(count):
+		for c in range(0, 16, 2): sample[c+1] = (n * (c + 3)) % 251
+		slog.add(ts, sample)
+		ts += td_ms if n % 500 else 10 * td_ms # occasional gaps
+	slog.flush()
+
+def bench(p, count, packed=False):
+	srb = (main.SampleRingBufferPacked if packed else main.SampleRingBuffer)(60_000, count)
+	srb.rollups.append(main.SampleRollup('1h', 3600_000, 1000, srb.lock))
+	slog = main.SampleLog(p, 64, 64 * 1024, 2**16)
+	ts = time.ticks_ms()
+	n = slog.restore(srb, count * (4 if packed else 1))
+	return n, time.ticks_diff(time.ticks_ms(), ts)
+
+
+p, counts = (sys.argv[1:2] or ['/tmp/aqm-bench-sample-log'])[0], sys.argv[2:]
+counts = list(map(int, counts or [1_000, 5_000, 20_000, 65_000]))
+print(f'{"samples":>8s} {"log-KiB":>8s} {"plain-ms":>9s} {"packed-ms":>9s}')
+for count in counts:
+	log_clean(p); log_fill(p, count)
+	bs = sum(os.stat(f'{p}/{fn}')[6] for fn in os.listdir(p))
+	n, ms = bench(p, min(count, 2**16 - 1))
+	np, ms_p = bench(p, min(count, 2**16 - 1) // 4 + 1, packed=True)
+	print(f'{n:>8d} {bs/1024:>8.1f} {ms:>9d} {ms_p:>9d}')
+log_clean(p)
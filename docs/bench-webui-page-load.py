@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# Measures WebUI page-load time (all files/data that page fetches, sequentially),
+#  with new connection for each request vs persistent HTTP/1.1 keep-alive connection.
+# Runs against either device URL or main.py WebUI started via docs/emulator.py,
+#  through a local proxy that adds network latency, to emulate WiFi round-trips.
+
+import sys, time, queue, socket, threading, statistics
+import pathlib as pl, subprocess as sp, http.client as hc, urllib.parse as up
+
+
+page_urls = [ '/', '/webui.js', '/d3.v7.min.js', '/favicon.ico',
+	'/data/all/latest-first/samples.v2_int16_columns.bin', '/data/marks.bin' ]
+
+def emulator_start():
+	# Runs main.py WebUI via docs/emulator.py in a subprocess, returns (proc, addr)
+	with socket.socket() as sock: sock.bind(('127.0.0.1', 0)); port = sock.getsockname()[1]
+	proc = sp.Popen( [ sys.executable, str(pl.Path(__file__).resolve().parent / 'emulator.py'),
+		'-p', str(port), '--ready-delay', '0' ], stdout=sp.DEVNULL )
+	for n in range(100):
+		try: socket.create_connection(('127.0.0.1', port), timeout=1).close()
+		except OSError: time.sleep(0.1)
+		else: return proc, ('127.0.0.1', port)
+	proc.terminate(); raise RuntimeError('Failed to connect to emulator WebUI')
+
+
+class LatencyProxy:
+	# Forwards TCP connections to dst with added one-way delay for each data chunk,
+	#  and a full round-trip before connecting, to account for TCP handshake.
+
+	def __init__(self, dst, rtt):
+		self.dst, self.rtt = dst, rtt
+		self.sock = socket.create_server(('127.0.0.1', 0))
+		self.addr = self.sock.getsockname()
+		threading.Thread(target=self.run, daemon=True).start()
+
+	def run(self):
+		while True:
+			conn, addr = self.sock.accept()
+			threading.Thread(target=self.conn, args=[conn], daemon=True).start()
+
+	def conn(self, conn):
+		time.sleep(self.rtt)
+		sock = socket.create_connection(self.dst)
+		for s in conn, sock: s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		for src, dst in (conn, sock), (sock, conn):
+			q = queue.Queue()
+			threading.Thread(target=self.pump_recv, args=[src, q], daemon=True).start()
+			threading.Thread(target=self.pump_send, args=[dst, q], daemon=True).start()
+
+	def pump_recv(self, sock, q):
+		while True:
+			try: buff = sock.recv(16384)
+			except OSError: buff = b''
+			q.put((time.monotonic() + self.rtt / 2, buff))
+			if not buff: break
+
+	def pump_send(self, sock, q):
+		while True:
+			ts, buff = q.get()
+			if (delay := ts - time.monotonic()) > 0: time.sleep(delay)
+			try:
+				if not buff: sock.shutdown(socket.SHUT_WR); break
+				sock.sendall(buff)
+			except OSError: break
+
+
+def page_load(addr, urls, keep_alive):
+	ts, conn = time.monotonic(), None
+	for url in urls:
+		if not conn: conn = hc.HTTPConnection(*addr, timeout=30)
+		conn.request('GET', url, headers={} if keep_alive else {'Connection': 'close'})
+		res = conn.getresponse(); res.read()
+		if res.status != 200: raise RuntimeError(f'HTTP error for {url}: {res.status} {res.reason}')
+		if not keep_alive or res.will_close: conn.close(); conn = None
+	if conn: conn.close()
+	return time.monotonic() - ts
+
+
+def main(args=None):
+	import argparse, textwrap
+	dd = lambda text: (textwrap.dedent(text).strip('\n') + '\n').replace('\t', '  ')
+	parser = argparse.ArgumentParser(
+		formatter_class=argparse.RawTextHelpFormatter, description=dd('''
+			Measure WebUI page-load time with and without HTTP/1.1 keep-alive connections.
+			Starts main.py WebUI via docs/emulator.py, if URL is not specified.'''))
+	parser.add_argument('url', nargs='?', help=dd('''
+		Base WebUI URL to run benchmark against, e.g. http://aqm.local/
+		main.py WebUI in docs/emulator.py subprocess is started to use as a default.'''))
+	parser.add_argument('-r', '--rtt', type=float, metavar='ms', default=20, help=dd('''
+		Network round-trip time to emulate via local proxy, in milliseconds.
+		WiFi to a microcontroller is usually 5-50ms. Default: %(default)s'''))
+	parser.add_argument('-n', '--repeat', type=int, metavar='n', default=10, help=dd('''
+		Number of page loads to measure, with median time printed. Default: %(default)s'''))
+	opts = parser.parse_args(sys.argv[1:] if args is None else args)
+
+	urls, emu = page_urls, None
+	if opts.url:
+		url = up.urlparse(opts.url)
+		dst, prefix = (url.hostname, url.port or 80), url.path.rstrip('/')
+		urls = list(prefix + url for url in urls)
+	else: emu, dst = emulator_start()
+	proxy = LatencyProxy(dst, opts.rtt / 1000)
+
+	try:
+		print(f'Page-load time for {len(urls)} requests, rtt={opts.rtt:.0f}ms, n={opts.repeat}:')
+		for name, keep_alive in ('connection-per-request', False), ('keep-alive', True):
+			ts = list(page_load(proxy.addr, urls, keep_alive) for n in range(opts.repeat))
+			print(f'  {name:>22s}: median={statistics.median(ts)*1000:,.0f}ms'
+				f' min={min(ts)*1000:,.0f}ms max={max(ts)*1000:,.0f}ms' )
+	finally:
+		if emu: emu.terminate(); emu.wait()
+
+if __name__ == '__main__': sys.exit(main())
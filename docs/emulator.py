@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+# Host-side stand-ins for device APIs used by main.py - machine.I2C/Pin, network.WLAN,
+#  time.ticks_* and such - with simulated SEN5x sensor on emulated I2C bus,
+#  to run whole app (sensor poller, WebUI, alerts) on a linux box without hardware.
+# Works with CPython, where it also has accelerated or fully-virtual clock,
+#  to simulate days of sampling in seconds, and with micropython unix port (real-time only).
+#
+# Usage: python3 docs/emulator.py [-c config.ini] [-x speed] [-t duration] [-p port]
+# Example: python3 docs/emulator.py -x 0 -t 3d --errors err_fan -p 8000
+#
+# Can be imported from other scripts, with install() called before "import main" there:
+#   import emulator; clock = emulator.install(speed=0); import main
+#   emulator.machine.i2c_devices[0x69] = emulator.Sen5xSim(clock, main.Sen5x.cmd_map)
+
+import os, sys, time, math, random, struct, asyncio
+
+cpython = sys.implementation.name == 'cpython'
+if cpython: import io, selectors, traceback
+
+
+class Clock:
+	# Monotonic clock in seconds, running at speed x real time, or only moving via skip()
+	# speed=0 is a fully-virtual time, where event loop skips to next timer when idle.
+
+	ticks_period = 2**30 # same as on rp2040 port
+
+	def __init__(self, speed=1.0):
+		self.speed, self.ts, self.ts_real = speed, 0.0, self.real()
+		self.ts_epoch = time.time()
+
+	def real(self):
+		if cpython: return time.monotonic()
+		return time.ticks_ms() / 1000 # micropython - speed must be 1
+
+	def __call__(self): return self.ts + (self.real() - self.ts_real) * self.speed
+
+	def set_speed(self, speed): self.ts, self.ts_real, self.speed = self(), self.real(), speed
+	def skip(self, td): self.ts += td
+
+	def ticks_ms(self): return int(self() * 1000) % self.ticks_period
+	def ticks_add(self, ts, td): return (ts + td) % self.ticks_period
+	def ticks_diff(self, ts1, ts2):
+		return (ts1 - ts2 + self.ticks_period // 2) % self.ticks_period - self.ticks_period // 2
+	def time(self): return self.ts_epoch + self()
+
+
+if cpython:
+
+	class EmuSelector(selectors.DefaultSelector):
+		# Selector for asyncio loop, with timeouts adjusted for Clock speed
+		def __init__(self, clock): self.clock = clock; super().__init__()
+		def select(self, timeout=None):
+			if speed := self.clock.speed: return super().select(timeout and timeout / speed)
+			if (ev := super().select(0)) or timeout == 0: return ev
+			if timeout is None: return super().select() # no timers, wait for I/O
+			self.clock.skip(timeout) # idle virtual-time loop - skip to next timer
+			return ev
+
+	class EmuLoop(asyncio.SelectorEventLoop):
+		def __init__(self, clock): self.clock = clock; super().__init__(EmuSelector(clock))
+		def time(self): return self.clock()
+
+	class EmuStream:
+		# Wraps asyncio reader to have close/wait_closed, as micropython Stream does
+		def __init__(self, reader, writer): self.reader, self.writer = reader, writer
+		def __getattr__(self, k): return getattr(self.reader, k)
+		def close(self): self.writer.close()
+		async def wait_closed(self):
+			try: await self.writer.wait_closed()
+			except OSError: pass
+		def get_extra_info(self, k): return self.writer.get_extra_info(k)
+
+
+class machine:
+	# Stand-in for micropython "machine" module, with I2C devices in i2c_devices
+
+	i2c_devices = dict() # addr -> device with write(bytes) and read_into(buff) methods
+
+	class Pin:
+		def __init__(self, n, *args, **kws): self.n = n
+
+	class I2C:
+		def __init__(self, n, sda=None, scl=None, freq=400_000, timeout=50_000):
+			self.n, self.sda, self.scl, self.freq = n, sda, scl, freq
+		def dev(self, addr):
+			if not (dev := machine.i2c_devices.get(addr)): raise OSError(5) # EIO, same as rp2
+			return dev
+		def writeto(self, addr, buff): self.dev(addr).write(bytes(buff))
+		def readfrom_into(self, addr, buff): self.dev(addr).read_into(buff)
+
+	def reset(): raise SystemExit('machine.reset() called')
+
+
+class network:
+	# Stand-in for micropython "network" module, with WLAN that can connect to any ssid
+
+	STA_IF, AP_IF = 0, 1
+	wlan_ssids = list() # ssids returned from WLAN.scan(), as bytes
+
+	def country(cc=None): return cc
+
+	class WLAN:
+		PM_NONE, PM_PERFORMANCE, PM_POWERSAVE = 0x111022, 0xa11142, 0x555552
+		def __init__(self, iface): self.iface, self.conf, self.ssid = iface, dict(), None
+		def active(self, state=None): return True
+		def config(self, **kws): self.conf.update(kws)
+		def scan(self): return list((ssid, b'', 1, -50, 3, False) for ssid in network.wlan_ssids)
+		def connect(self, ssid=None, key=None, bssid=None): self.ssid = ssid
+		def isconnected(self): return self.iface == network.AP_IF or bool(self.ssid)
+		def ifconfig(self): return '127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1'
+
+
+class deflate:
+	# Stand-in for micropython "deflate" module, compressing data via zlib in CPython
+
+	AUTO, RAW, ZLIB, GZIP = 0, 1, 2, 3
+
+	class DeflateIO:
+		def __init__(self, stream, format=0, wbits=0, close=False):
+			import zlib
+			wbits = max(9, wbits or 8) # zlib min is 9
+			wbits = {deflate.RAW: -wbits, deflate.GZIP: 16 + wbits}.get(format, wbits)
+			self.stream, self.close_stream, self.c = stream, close, zlib.compressobj(wbits=wbits)
+		def write(self, buff): self.stream.write(self.c.compress(buff)); return len(buff)
+		def close(self):
+			self.stream.write(self.c.flush())
+			if self.close_stream: self.stream.close()
+
+
+class Sen5xSim:
+	# Simulated SEN5x sensor, responding to same I2C commands as Sen5x class in main.py
+	# New measurement is available every second after meas_start command and ready_delay.
+	# Values are from sample_func(ts) -> (pm10, pm25, pm40, pm100, rh, t, voc, nox),
+	#  where None is for not-available values, and ts is seconds since measurement start.
+	# Raises OSError (I2C NACK) for unknown commands, CRC mismatches, reads too early,
+	#  and with i2c_fail_rate probability on any command.
+
+	err_bits = dict(warn_fan_speed=21, err_gas=7, err_rht=6, err_laser=5, err_fan=4)
+	sample_ks = 10, 10, 10, 10, 100, 200, 10, 10
+	sample_nx = 0xffff, 0xffff, 0xffff, 0xffff, 0x7fff, 0x7fff, 0x7fff, 0x7fff
+
+	def __init__( self, clock, cmd_map, sample_func=None, errs=(),
+			ready_delay=1.1, clean_time=10.0, i2c_fail_rate=0, serial='SIM5X0000001' ):
+		self.clock, self.ready_delay, self.clean_time = clock, ready_delay, clean_time
+		self.sample_func, self.i2c_fail_rate = sample_func or self.sample_wave, i2c_fail_rate
+		self.cmds = dict((cmd[0], (k, cmd[1])) for k, cmd in cmd_map.items())
+		self.serial, self.temp_comp, self.errs = serial, (0, 0, 0), 0
+		for err in errs: self.errs |= 1 << self.err_bits[err]
+		self.meas_ts = self.clean_ts = self.rx = self.rx_ts = None
+		self.n_read, self.n_cmds = -1, dict()
+
+	@staticmethod
+	def crc8(b1, b2, crc=0xff):
+		for b in b1, b2:
+			crc ^= b
+			for n in range(8): crc = ((crc << 1) ^ 0x31 if crc & 0x80 else crc << 1) & 0xff
+		return crc
+
+	def crc_wrap(self, data):
+		rx = bytearray()
+		for n in range(0, len(data), 2): rx.extend(data[n:n+2] + bytes([self.crc8(*data[n:n+2])]))
+		return rx
+
+	def sample_wave(self, ts):
+		# Daily/hourly sine waves with noise, VOC/NOx are missing during first minute
+		day, hour = (math.sin(2 * math.pi * ts / td) for td in [86400, 3600])
+		pm = max(0.0, 8 + 5 * day + 2 * hour + random.random())
+		voc = nox = None
+		if ts > 60: voc, nox = 100 + 40 * day + 5 * random.random(), 1 + max(0, 3 * hour)
+		return pm * 0.8, pm, pm * 1.1, pm * 1.2, 45 + 10 * day, 22 - 3 * day, voc, nox
+
+	def sample_n(self):
+		# Returns number of current measurement, or -1 if there's none yet
+		if self.meas_ts is None: return -1
+		ts = self.clock() - self.meas_ts - self.ready_delay
+		if self.clean_ts is not None: # no new measurements during fan cleaning
+			if (td := self.clock() - self.clean_ts) < self.clean_time: ts -= td
+			else: self.meas_ts += self.clean_time; self.clean_ts = None
+		return int(ts) if ts >= 0 else -1
+
+	def write(self, buff):
+		self.rx = None
+		if self.i2c_fail_rate and random.random() < self.i2c_fail_rate: raise OSError(5)
+		if not (cmd := self.cmds.get(buff[:2])): raise OSError(5)
+		(k, delay), args = cmd, buff[2:]
+		for n in range(0, len(args), 3):
+			if self.crc8(*args[n:n+2]) != args[n+2]: raise OSError(5)
+		args = bytes(b for n, b in enumerate(args) if n % 3 != 2)
+		self.n_cmds[k] = self.n_cmds.get(k, 0) + 1
+		if rx := getattr(self, f'cmd_{k}')(args):
+			self.rx, self.rx_ts = self.crc_wrap(rx), self.clock() + delay * 0.9
+
+	def read_into(self, buff):
+		if self.rx is None or len(buff) > len(self.rx): raise OSError(5)
+		if self.clock() < self.rx_ts: raise OSError(5) # read before command delay
+		buff[:] = self.rx[:len(buff)]; self.rx = None
+
+	def cmd_meas_start(self, args):
+		if self.meas_ts is None: self.meas_ts, self.n_read = self.clock(), -1
+	def cmd_meas_stop(self, args): self.meas_ts = self.clean_ts = None
+	def cmd_reset(self, args): self.cmd_meas_stop(args); self.errs = 0
+	def cmd_clean_fan(self, args):
+		if self.meas_ts is not None and self.clean_ts is None: self.clean_ts = self.clock()
+	def cmd_temp_offset_get(self, args): return struct.pack('>hhH', *self.temp_comp)
+	def cmd_temp_offset_set(self, args): self.temp_comp = struct.unpack('>hhH', args)
+	def cmd_data_ready(self, args): return bytes([0, int(self.sample_n() > self.n_read)])
+	def cmd_data_read(self, args):
+		if (n := self.sample_n()) < 0: return struct.pack('>HHHHhhhh', *self.sample_nx)
+		self.n_read, sample = n, self.sample_func(self.clock() - self.meas_ts)
+		return struct.pack('>HHHHhhhh', *(
+			(nx if v is None else round(v * k)) for v, k, nx
+			in zip(sample, self.sample_ks, self.sample_nx) ))
+	def cmd_errs_read(self, args): return self.errs.to_bytes(4, 'big')
+	def cmd_errs_read_clear(self, args):
+		errs, self.errs = self.errs, 0
+		return errs.to_bytes(4, 'big')
+	def cmd_get_serial(self, args): return self.serial.encode() + bytes(32 - len(self.serial))
+
+
+def install(speed=1.0):
+	# Installs stand-in modules/functions to import main.py with, returns Clock
+	clock = Clock(speed)
+	for k, mod in ('machine', machine), ('network', network): sys.modules[k] = mod
+	if not cpython:
+		if speed != 1: raise ValueError('Only real-time clock (speed=1) works in micropython')
+		return clock
+	import gc
+	sys.modules['deflate'] = deflate
+	time.ticks_ms, time.ticks_add, time.ticks_diff, time.time = (
+		clock.ticks_ms, clock.ticks_add, clock.ticks_diff, clock.time )
+	gc.mem_free, gc.mem_alloc, gc.threshold = lambda: 200_000, lambda: 64_000, lambda *a: None
+	asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+	def print_exception(err, file=sys.stdout):
+		tb = ''.join(traceback.format_exception(err))
+		file.write(tb.encode() if isinstance(file, io.BytesIO) else tb)
+	sys.print_exception = print_exception
+	start_server = asyncio.start_server
+	asyncio.start_server = lambda cb, *args, **kws: start_server(
+		lambda reader, writer: cb(EmuStream(reader, writer), writer), *args, **kws )
+	asyncio.set_event_loop(EmuLoop(clock))
+	return clock
+
+
+async def run(main, conf, clock, duration=None):
+	wifi = None
+	if conf.wifi_ap_conf: main.wifi_ap_setup(conf.wifi_ap_conf)
+	elif conf.wifi_sta_aps:
+		network.wlan_ssids.extend(ssid.encode() for ssid in conf.wifi_sta_aps)
+		wifi = asyncio.create_task(main.wifi_client(conf.wifi_sta_conf, conf.wifi_sta_aps))
+	ts, ts_real = clock(), clock.real()
+	try: await asyncio.wait_for(main.main_aqm(conf, wifi), duration)
+	except asyncio.TimeoutError: pass
+	finally:
+		if wifi: wifi.cancel()
+		td, td_real = clock() - ts, clock.real() - ts_real
+		print( f'--- Emulator: {td / 3600:,.1f}h emulated in'
+			f' {td_real:,.1f}s real time ({td / max(td_real, 0.001):,.0f}x) ---' )
+
+def main(args=None):
+	import argparse, textwrap
+	dd = lambda text: (textwrap.dedent(text).strip('\n') + '\n').replace('\t', '  ')
+	parser = argparse.ArgumentParser(
+		formatter_class=argparse.RawTextHelpFormatter, description=dd('''
+			Run main.py with emulated device APIs and simulated SEN5x sensor.
+			Uses default settings, or config file, with port/I2C parameters overidden.'''))
+	parser.add_argument('-c', '--config', metavar='file', help=dd('''
+		Config file to use, e.g. config.ini or config.example.ini in repository.'''))
+	parser.add_argument('-x', '--speed', type=float, metavar='x', default=1, help=dd('''
+		Clock speed multiplier, relative to real time, e.g. 100 = 100x faster.
+		0 is a special "virtual time" mode, where time only moves by skipping
+		 to next scheduled event whenever event loop is idle, i.e. as fast as possible.
+		Anything but 1 only works with CPython. Default: %(default)s'''))
+	parser.add_argument('-t', '--duration', metavar='time', help=dd('''
+		Emulated time to stop after, in seconds or with s/m/h/d suffix, e.g. 7d.
+		Runs until interrupted by default.'''))
+	parser.add_argument('-p', '--port', type=int, metavar='port', default=8000, help=dd('''
+		Local TCP port to run WebUI on. Default: %(default)s'''))
+	parser.add_argument('-e', '--errors', metavar='names', default='', help=dd('''
+		Comma-separated SEN5x error flags to set, e.g. err_fan,warn_fan_speed.
+		Recognized ones: ''' + ' '.join(Sen5xSim.err_bits)))
+	parser.add_argument('--i2c-fail-rate', type=float, metavar='p', default=0, help=dd('''
+		Probability of simulated I2C failure for each command, e.g. 0.01. Default: %(default)s'''))
+	parser.add_argument('--ready-delay', type=float, metavar='s', default=1.1, help=dd('''
+		Delay before first sensor measurement is ready, in seconds. Default: %(default)s'''))
+	parser.add_argument('--seed', type=int, metavar='n', help='Random seed for sensor values.')
+	opts = parser.parse_args(sys.argv[1:] if args is None else args)
+
+	duration = opts.duration and float(opts.duration.rstrip('smhd')) * {
+		's': 1, 'm': 60, 'h': 3600, 'd': 24*3600 }.get(opts.duration[-1], 1)
+	if opts.seed is not None: random.seed(opts.seed)
+
+	clock = install(opts.speed)
+	p_repo = __file__.rsplit('/', 2)[0] if __file__.count('/') > 1 else '..'
+	os.chdir(p_repo) # for WebUI static files
+	sys.path.insert(0, '.')
+	import main as aqm
+
+	conf = aqm.conf_parse(opts.config) if opts.config else aqm.AQMConf()
+	conf.webui_port = opts.port
+	for k in 'sensor_i2c_n', 'sensor_i2c_pin_sda', 'sensor_i2c_pin_scl':
+		if getattr(conf, k) < 0: setattr(conf, k, 0)
+	machine.i2c_devices[conf.sensor_i2c_addr] = sen5x = Sen5xSim(
+		clock, aqm.Sen5x.cmd_map, ready_delay=opts.ready_delay,
+		errs=opts.errors.replace(',', ' ').split(), i2c_fail_rate=opts.i2c_fail_rate )
+	print(f'--- Emulator: WebUI URL - http://localhost:{opts.port}/ ---')
+
+	coro = run(aqm, conf, clock, duration)
+	try:
+		if cpython: asyncio.get_event_loop().run_until_complete(coro)
+		else: asyncio.run(coro)
+	except KeyboardInterrupt: pass
+	print( '--- Emulator: SEN5x commands -',
+		' '.join(f'{k}={n:,d}' for k, n in sorted(sen5x.n_cmds.items())), '---' )
+
+if __name__ == '__main__': sys.exit(main())
@@ -1,21 +1,32 @@
 #!/usr/bin/env python
 
 import pathlib as pl, datetime as dt
-import os, sys, re, base64, gzip, argparse, textwrap
+import os, sys, re, base64, gzip, struct, argparse, textwrap
 
 dd = lambda text: re.sub( r' \t+', ' ',
 	textwrap.dedent(text).strip('\n') + '\n' ).replace('\t', '  ')
 
+def data_samples_count(data):
+	# Returns number of samples in either binary data export format, or raises ValueError
+	if data[:4] == b'\xff\xffAQ': # v2_int16_columns - header, time-offset segments, columns
+		ver, count, k, segs = struct.unpack_from('>HIHH', data, 4)
+		if ver != 2 or len(data) != 38 + segs * 16 + count * 16:
+			raise ValueError(f'v2-format data size mismatch [v{ver}]: {len(data):,d}B')
+		return count
+	if len(data) % 24: raise ValueError(f'Data size is not multiple of 24B: {len(data):,d}B')
+	return len(data) // 24
+
 def main(argv=None):
 	parser = argparse.ArgumentParser(
 		formatter_class=argparse.RawTextHelpFormatter,
 		description=dd('''
-			Create self-contained HTML visualization page from
-				rp2040-sen5x-aqm samples.8Bms_16Bsen5x_tuples.bin data file.
+			Create self-contained HTML visualization page from rp2040-sen5x-aqm
+				samples.8Bms_16Bsen5x_tuples.bin or samples.v2_int16_columns.bin data file.
 			Needs to be run from a project repository, to embed base
 				HTML/JS files there into resulting output along with the data.'''))
 	parser.add_argument('data_bin', help=dd('''
-		samples.8Bms_16Bsen5x_tuples.bin data file downloaded from the device.
+		samples.8Bms_16Bsen5x_tuples.bin or samples.v2_int16_columns.bin
+			data file downloaded from the device, in either of these formats.
 		File's modification time (mtime) is important, and is used
 			as a time when data snapshot was taken mark,
 			with times of all data samples within the file offset relative to that.'''))
@@ -33,6 +44,8 @@ def main(argv=None):
 	p_data_bin = pl.Path(opts.data_bin).resolve()
 
 	data = p_data_bin.read_bytes()
+	try: data_samples_count(data)
+	except ValueError as err: parser.error(f'Unrecognized data file format: {err}')
 	if opts.datetime_from_filename:
 		if not (m := re.search( r'(^|.)(\d{4}-\d{2}-\d{2}'
 				r'([ T])\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[-+]\d{2}(:?\d{2})?)?)(.|$)', opts.data_bin )):
@@ -1,11 +1,13 @@
 # -*- mode: python -*-
 
-import os, gc, struct, machine, time
+import os, io, gc, struct, machine, time
 
 try: import network # required for wifi stuff
 except ImportError: network = None
 try: import socket # required for webui
 except ImportError: socket = None
+try: import deflate # for gzip-compressed webui responses, if firmware supports that
+except ImportError: deflate = None
 
 try: import uasyncio as asyncio
 except ImportError: import asyncio # newer mpy naming
@@ -20,6 +22,17 @@ class AQMConf:
 	sensor_verbose = False
 	sensor_sample_interval = 60.0
 	sensor_sample_count = 1_000
+	sensor_sample_rollups = '' # e.g. "10m:1000 1h:1000" - interval:count pairs
+	sensor_sample_packed = False
+	sensor_sample_adaptive = False
+	sensor_sample_adaptive_interval = 2.0
+	sensor_sample_adaptive_hold = 600.0
+	sensor_sample_adaptive_pm_delta = 3.0
+	sensor_sample_adaptive_voc_delta = 15.0
+	sensor_sample_log = '' # directory to store log of samples in, if any
+	sensor_sample_log_batch = 64
+	sensor_sample_log_segment_kb = 64
+	sensor_sample_log_segments = 4
 	sensor_reset_on_start = False
 	sensor_stop_on_exit = True
 	sensor_error_check_interval = 3701.0
@@ -38,11 +51,26 @@ class AQMConf:
 	webui_verbose = False
 	webui_port = 80
 	webui_conn_backlog = 5
+	webui_conn_requests = 20
+	webui_conn_idle_timeout = 5.0
+	webui_conn_per_peer = 10 # 0 - no limit
+	webui_read_timeout = 10.0
+	webui_write_timeout = 30.0
+	webui_header_max_bytes = 2048
+	webui_buffers = 3
+	webui_buffer_size = 2048
+	webui_buffer_wait = 5.0
+	webui_gzip_window_bits = 8
 	webui_title = 'RP2040 SEN5x Air Quality Monitor'
 	webui_url_prefix = ''
 	webui_marks_storage_bytes = 512
 	webui_d3_api = 7
 	webui_d3_load_from_internet = False
+	webui_data_poll = True
+	webui_data_live_clients = 2
+	webui_data_live_timeout = 10.0
+	webui_graph_points = 0
+	webui_graph_points_func = 'mean'
 
 	alerts_verbose = False
 	alerts_nx = -999.0
@@ -51,6 +79,10 @@ class AQMConf:
 	alerts_send_to = ''
 	alerts_bind_port = 5683
 
+	debug_stats = False
+	debug_stats_loop_interval = 1.0
+	debug_stats_mem_interval = 60.0
+
 p_err = lambda *a: print('ERROR:', *a)
 err_fmt = lambda err: f'[{err.__class__.__name__}] {err}'
 
@@ -66,6 +98,60 @@ def token_bucket_iter(spec): # spec = N / M[smhd], e.g. 10 / 15m
 def val_iter(val=None): # placeholder for iterators
 	while True: yield val
 
+
+class Stats:
+	# Runtime counters and histograms of durations in ms, grouped by component
+	# Only created when enabled in config, with all callers checking "stats and ...".
+	# Histograms are [count, sum, max, *buckets], where each bucket counts values
+	#  below 1, 2, 4, ... 2^(hist_n-2) ms, and last one counts all larger values.
+
+	hist_n, mem_trend_n = 12, 32
+
+	def __init__(self, loop_td, mem_td):
+		self.hists, self.counts, self.ts_start = dict(), dict(), time.time()
+		self.loop_td, self.mem_td, self.mem_free_min = loop_td, mem_td, gc.mem_free()
+		self.mem_trend, self.mem_trend_pos = [-1] * self.mem_trend_n, 0
+
+	def td(self, group, key, ts): # adds time since ticks_ms() ts to histogram
+		self.add(group, key, time.ticks_diff(time.ticks_ms(), ts))
+
+	def add(self, group, key, v):
+		if not (g := self.hists.get(group)): g = self.hists[group] = dict()
+		if not (h := g.get(key)): h = g[key] = [0] * (3 + self.hist_n)
+		v = max(0, v) # negative lag from early wakeups counts as zero
+		h[0] += 1; h[1] += v
+		if v > h[2]: h[2] = v
+		b = 0
+		while v >> b and b < self.hist_n - 1: b += 1
+		h[3+b] += 1
+
+	def inc(self, group, key, n=1):
+		if not (g := self.counts.get(group)): g = self.counts[group] = dict()
+		g[key] = g.get(key, 0) + n
+
+	async def monitor(self):
+		# Tracks event loop lag from sleep() wakeups and free memory over time
+		ts_mem = ts = time.ticks_ms()
+		while True:
+			await asyncio.sleep_ms(self.loop_td)
+			self.add('loop', 'lag', time.ticks_diff(ts_new := time.ticks_ms(), ts) - self.loop_td)
+			if (mem := gc.mem_free()) < self.mem_free_min: self.mem_free_min = mem
+			if time.ticks_diff(ts := ts_new, ts_mem) >= self.mem_td:
+				self.mem_trend[self.mem_trend_pos] = mem
+				self.mem_trend_pos, ts_mem = (self.mem_trend_pos + 1) % self.mem_trend_n, ts
+
+	def json(self):
+		import json
+		n = self.mem_trend_pos
+		return json.dumps(dict(
+			uptime=int(time.time() - self.ts_start),
+			hist_buckets_ms=list(2**n for n in range(self.hist_n - 1)),
+			mem=dict( free=gc.mem_free(), alloc=gc.mem_alloc(), free_min=self.mem_free_min,
+				free_trend=list(v for v in self.mem_trend[n:] + self.mem_trend[:n] if v >= 0) ),
+			hist=self.hists, count=dict(
+				(k, dict((str(ck), v) for ck, v in g.items())) for k, g in self.counts.items() ) ))
+
+
 # XXX: more mobile-friendly/responsive WebUI
 # webui_head is not templated, so can be full of {}
 webui_head = b'''<!DOCTYPE html>
@@ -89,7 +175,7 @@ svg .marks line { stroke-width: 2; }
 #errors { width: 40rem; list-style: none; padding: 0; }
 #errors li { background: #9b2220; font-weight: bold;
 	margin: .5rem; padding: .5rem 1rem; border-radius: .4rem; }
-#errors li::before { content: '⚠️'; margin-right: .4rem; }
+#errors li::before { content: '\\26a0\\fe0f'; margin-right: .4rem; }
 #marks {
 	display: flex; align-items: stretch; position: relative;
 	min-height: 10rem; width: 90%; margin: 1rem auto; }
@@ -108,11 +194,12 @@ svg .marks line { stroke-width: 2; }
 	padding: .6rem; border-color: var(--c-fg); background: var(--c-bg); }
 </style>'''
 
-webui_body = b'''
+webui_body = '''
 <title>{title}</title><body><h3>{title}</h3>
 <ul id=exports>
 	<li><a href={url_data_csv!r}>Data export in CSV</a>
 	<li><a id=data-url href={url_data_bin!r}>Data export in binary format</a>
+	<li><a href={url_data_cols!r}>Data export in compact columnar binary format</a>
 </ul>
 <ul id=actions>{sen_actions}</ul>
 <ul id=errors>{err_msgs}</ul>
@@ -126,9 +213,13 @@ webui_body = b'''
 window.aqm_opts = {{
 	d3_api: {d3_api},
 	d3_from_cdn: {d3_from_cdn},
-	marks_bs_max: {marks_bs_max} }}
+	marks_bs_max: {marks_bs_max},
+	poll_interval: {poll_interval},
+	data_max: {data_max} }}
 window.aqm_urls = {{
-	data: {url_data_bin!r},
+	data: {url_data_graph!r},
+	data_since: {url_data_since!r},
+	data_live: {url_data_live!r},
 	marks: {url_data_marks!r},
 	d3: {url_js_d3!r} }}
 </script>
@@ -206,7 +297,7 @@ def conf_parse(conf_file):
 			else: p_err(f'{prefix} Unrecognized config key [ {key_raw} ]')
 		conf.wifi_sta_conf, conf.wifi_sta_aps = ap_map.pop(None), ap_map
 
-	for sk in 'sensor', 'webui', 'alerts':
+	for sk in 'sensor', 'webui', 'alerts', 'debug':
 		if not (sec := conf_lines.get(sk)): continue
 		for key_raw, key, val in sec:
 			key_conf = f'{sk}_{key}'
@@ -326,8 +417,8 @@ class Sen5x:
 		b'\xbd\x8c\xdf\xeeyH\x1b*\xc1\xf0\xa3\x92\x054gVxI\x1a+\xbc\x8d\xde\xef'
 		b'\x82\xb3\xe0\xd1Fw$\x15;\nYh\xff\xce\x9d\xac' )
 
-	def __init__(self, i2c, addr=0x69):
-		self.bus, self.addr, self.cmd_lock = i2c, addr, asyncio.Lock()
+	def __init__(self, i2c, addr=0x69, stats=None):
+		self.bus, self.addr, self.cmd_lock, self.stats = i2c, addr, asyncio.Lock(), stats
 		self.rx_mv, self.rx_buff = memoryview(rx := bytearray(24)), rx
 		self.cmd_ms_last = self.cmd_ms_wait = -1
 
@@ -341,10 +432,15 @@ class Sen5x:
 			cmd, delay, rx_bytes, rx_parser = cmd
 			if not parse: rx_parser = None
 		if cmd_args: raise ValueError(f'Arguments to no-TX SEN5x command: {cmd_args}')
+		if stats := self.stats: ts = time.ticks_ms()
 		await self.cmd_lock.acquire()
 		try: return await self._run(cmd, delay, tx_bytes, rx_bytes, rx_parser, buff)
-		except OSError as err: raise self.Sen5xError(f'I2C I/O failure: {err_fmt(err)}')
-		finally: self.cmd_lock.release()
+		except OSError as err:
+			stats and stats.inc('i2c_err', cmd_name)
+			raise self.Sen5xError(f'I2C I/O failure: {err_fmt(err)}')
+		finally:
+			self.cmd_lock.release()
+			stats and stats.td('i2c', cmd_name, ts)
 
 	async def _run( self, cmd, delay,
 			tx_bytes, rx_bytes, rx_parser, rx_smv, crc8_map=crc8_map ):
@@ -395,7 +491,7 @@ class Sen5x:
 
 async def sen5x_poller(
 		sen5x, srb, td_data, td_errs, err_rate_limit,
-		stop_on_exit=False, alerts=None, verbose=False ):
+		stop_on_exit=False, alerts=None, adaptive=None, verbose=False ):
 	p_log = verbose and (lambda *a: print('[sensor]', *a))
 	await sen5x('meas_start')
 	p_log and p_log('Started measurement mode')
@@ -403,7 +499,7 @@ async def sen5x_poller(
 	try:
 		err_last = ValueError('Invalid error rate-limiter settings')
 		while next(err_rate_limit):
-			try: await _sen5x_poller(sen5x, srb, alerts, td_data, td_errs, p_log)
+			try: await _sen5x_poller(sen5x, srb, alerts, adaptive, td_data, td_errs, p_log)
 			except Sen5x.Sen5xError as err:
 				p_log and p_log(f'Sen5x poller failure: {err_fmt(err)}')
 				err_last = err
@@ -415,8 +511,8 @@ async def sen5x_poller(
 				p_err(f'Failed to stop measurement mode: {err_fmt(err)}')
 			p_log and p_log('Stopped measurement mode')
 
-async def _sen5x_poller(sen5x, srb, alerts, td_data, td_errs, p_log):
-	errs_seen, td_slack = set(), 10 # less loops when sleep() wakes up early
+async def _sen5x_poller(sen5x, srb, alerts, adaptive, td_data, td_errs, p_log):
+	errs_seen, td_slack, stats = set(), 10, sen5x.stats # less loops when sleep() wakes up early
 	ts_data = ts_errs = -1 # time of last data/errs poll
 	while True:
 		ts = ts_loop = time.ticks_ms()
@@ -428,16 +524,24 @@ async def _sen5x_poller(sen5x, srb, alerts, td_data, td_errs, p_log):
 				while not await sen5x('data_ready'):
 					p_log and p_log('data_ready delay')
 					await asyncio.sleep_ms(200)
+			if stats: ts_lock = time.ticks_ms()
 			await srb.lock.acquire()
 			try:
+				stats and stats.td('lock_wait', 'sensor', ts_lock)
 				ts, buff = time.ticks_ms(), srb.sample_mv(ts)
 				data = await sen5x('data_read', parse=p_log, buff=buff)
 				srb.sample_mv_commit(ts)
+				if adaptive and (td := adaptive(ts, buff)) != td_data:
+					p_log and p_log(f'Sampling interval change: {td_data / 1000:.1f}s -> {td / 1000:.1f}s')
+					srb.sample_td_set(td_data := td)
 			finally: srb.lock.release()
+			stats and stats.td('sensor', 'sample', ts_loop)
 			if p_log:
 				pm10, pm25, pm40, pm100, rh, t, voc, nox = data
 				p_log(f'data: {pm10=} {pm25=} {pm40=} {pm100=} {rh=} {t=} {voc=} {nox=}')
-			if alerts: alerts.check(data, bytes(buff))
+			if alerts:
+				ts = time.ticks_ms(); alerts.check(data, bytes(buff))
+				stats and stats.td('alerts', 'check', ts)
 			if time.ticks_diff(ts := time.ticks_ms(), ts_data) - td_data > td_data:
 				td1, ts_data = td_data, ts # set new ts-base at the start or after skips
 			else: # next poll at ts_loop + td_data, to keep intervals from drifting
@@ -463,49 +567,183 @@ class SampleRingBuffer:
 	# If new sample has ts - n_ts > 2 * n_td (i.e. doesn't belong in next slot),
 	#   blk_skip is inserted with extra ms to add on top of n_td for that slot,
 	#   otherwise delta between samples is always n_td, as enforced by poller.
+	# Sampling interval can be changed via sample_td_set(), which inserts blk_td
+	#   with new/old n_td values, and delta is the new value for samples after it.
 	# To read samples back, blocks can be iterated in a circular reverse-order,
 	#   decrementing timestamp by regular delta + decoded blk_skip values (if any).
+	# n_seq counts all samples ever committed, and with random n_id (changes on reboot)
+	#   is used as a "cursor" for clients to only fetch samples added after it.
+	# skip_idx has (n_seq, blk_n, t, td) tuple for every blk_skip/blk_td, with n_seq of
+	#   sample before it, count of all such blocks, and t/td to get "time" of samples after
+	#   it as t + (seq - n_seq) * td, starting with a base tuple for the oldest one(s),
+	#   to find time offset and slot of any sample in the buffer.
+	# Readers don't lock the buffer, and stop when slots they didn't get to yet
+	#   are overwritten by new samples, which is checked via n_slots counter of all slots.
 
 	blk_skip = b'\xff\xfe\0\0' # two first impossible-values to mark time-skip blocks
+	blk_td = b'\xff\xfd\0\0' # sampling interval changes
 	sbs, ebs, s0 = Sen5x.sample_bs, Sen5x.errs_bs, Sen5x.errs_bs # binary sample params
 	s_parse, errs_parse = staticmethod(Sen5x.sample_parse), staticmethod(Sen5x.errs_parse)
+	s_keys = 'pm10', 'pm25', 'pm40', 'pm100', 'rh', 't', 'voc', 'nox'
+	s_fmt, s_nx = '>HHHHhhhh', (0xffff, 0xffff, 0xffff, 0xffff, 0x7fff, 0x7fff, 0x7fff, 0x7fff)
+	s_ks = 10, 10, 10, 10, 100, 200, 10, 10 # value divisors, same as in Sen5x.sample_parse
 
 	def __init__(self, td_ms, count):
-		self.n = self.n_loops = self.n_skips = 0
-		self.n_ts = self.skip_last_pos = None
+		self.n = self.n_loops = self.n_skips = self.n_seq = self.n_slots = 0 # n_skips = blk_*
+		self.rollups = list() # SampleRollup objects to pass new samples to
+		self.n_ts = self.skip_last_pos = self.td_last_pos = self.log = None # log = SampleLog
+		self.skip_idx = [(0, 0, 0, td_ms)]
+		self.n_id = int.from_bytes(os.urandom(3), 'big')
 		self.n_td, self.n_max = td_ms, count
 		self.buff = bytearray(self.s0 + self.sbs * self.n_max)
 		self.buff_mv = memoryview(self.buff)
 		self.buff_mv_err = self.buff_mv[:self.ebs]
-		self.lock = asyncio.Lock() # to avoid read/write races
+		self.lock = asyncio.Lock() # for writers, to not interleave samples
+		self.n_ev = asyncio.Event() # set on new samples, cleared by whoever waits for it
 
 	def sample_mv(self, ts):
 		# Returns memoryview to store new sample into
-		pos = self.s0 + self.n * self.sbs
-		if self.buff[pos:pos+4] == self.blk_skip: self.n_skips -= 1
+		pos = self.s0 + self.slot_reclaim() * self.sbs
 		if self.n_ts is not None and (
 				td := time.ticks_diff(ts, self.n_ts) - self.n_td ) > self.n_td:
 			self.sample_mv_commit(ts, td)
 			return self.sample_mv(ts + self.n_td)
 		return self.buff_mv[pos:pos+self.sbs]
 
+	def slot_reclaim(self):
+		# Returns current slot number, updating counters if it had blk_skip/blk_td in it
+		pos = self.s0 + self.n * self.sbs
+		if self.buff[pos] == 0xff and self.buff[pos:pos+4] in (self.blk_skip, self.blk_td):
+			self.n_skips -= 1; self.skip_idx_trim()
+		return self.n
+
 	def sample_mv_commit(self, ts, td_skip=None):
 		# Mark current/last returned sample_mv as used and advance cursor
 		if td_skip: # skip block, storing skipped time-delta in it
 			if pos := self.skip_last_pos: # collapse repeated blk_skip, if any
-				td_skip += self.n_td + int.from_bytes(self.buff[pos+4:pos+8], 'big')
+				td_skip += self.n_td + (td := int.from_bytes(self.buff[pos+4:pos+8], 'big'))
 				self.n -= 1
 			else:
 				pos = self.skip_last_pos = self.s0 + self.n * self.sbs
 				self.buff[pos:pos+4] = self.blk_skip
-				self.n_skips += 1
+				self.n_skips, self.n_slots, td = self.n_skips + 1, self.n_slots + 1, None
 			if td_skip > 0xffffffff: # >50d delta = overflow - flush all old data
-				self.n_ts = None; self.n = self.n_loops = self.n_skips = 0; return
+				for pos in range(self.s0, len(self.buff), self.sbs): self.buff[pos] = 0
+				self.n_ts = self.skip_last_pos = self.td_last_pos = None
+				self.n = self.n_loops = self.n_skips = 0; self.n_slots += self.n_max
+				self.skip_idx = [(self.n_seq, 0, 0, self.n_td)]; return
 			self.buff[pos+4:pos+8] = td_skip.to_bytes(4, 'big')
-		else: self.skip_last_pos = None
+			self.skip_idx_add(td_skip, td)
+			self.td_last_pos = None
+		else:
+			self.skip_last_pos = self.td_last_pos = None
+			self.n_seq, self.n_slots = self.n_seq + 1, self.n_slots + 1
+			self.n_ev.set()
+			if self.rollups or self.log:
+				pos = self.s0 + self.n * self.sbs
+				sample = self.buff_mv[pos:pos+self.sbs]
+				for r in self.rollups: r.add(ts, sample)
+				if self.log: self.log.add(ts, sample)
 		self.n_ts, self.n = ts, (self.n + 1) % self.n_max
 		if not self.n: self.n_loops += 1
 
+	def sample_td_set(self, td_ms):
+		# Changes sampling interval for next samples, updating last blk_td if it's unused
+		if td_ms == self.n_td: return
+		if not (pos := self.td_last_pos):
+			pos = self.td_last_pos = self.s0 + self.slot_reclaim() * self.sbs
+			self.buff[pos:pos+4] = self.blk_td
+			self.buff[pos+8:pos+12] = self.n_td.to_bytes(4, 'big')
+			self.skip_idx_td(td_ms)
+			self.n_skips, self.n_slots, self.skip_last_pos = self.n_skips + 1, self.n_slots + 1, None
+			self.n = (self.n + 1) % self.n_max
+			if not self.n: self.n_loops += 1
+		else: self.skip_idx_td(td_ms, True)
+		self.buff[pos+4:pos+8] = td_ms.to_bytes(4, 'big')
+		self.n_td = td_ms
+
+	def skip_idx_add(self, td_skip, td_last=None):
+		# Adds blk_skip to skip_idx, or updates last one with td_skip, if td_last is set
+		s, k, t, td = self.skip_idx[-1]
+		if td_last is not None: self.skip_idx[-1] = s, k, t - td_last + td_skip, td
+		else: self.skip_idx.append((self.n_seq, k + 1, t + (self.n_seq - s) * td + td_skip, td))
+
+	def skip_idx_td(self, td_ms, update=False):
+		# Adds blk_td to skip_idx, or updates interval in the last one
+		s, k, t, td = self.skip_idx[-1]
+		if update: self.skip_idx[-1] = s, k, t, td_ms
+		else: self.skip_idx.append((self.n_seq, k + 1, t + (self.n_seq - s) * td, td_ms))
+
+	def skip_idx_trim(self):
+		# Removes skip_idx entries before oldest sample, except one for it as a new base
+		n, idx = self.n_seq - self.data_samples_count() + 1, self.skip_idx
+		while len(idx) > 1 and idx[1][0] < n: idx.pop(0)
+
+	def skip_idx_find(self, seq):
+		# Returns skip_idx entry for last blk_skip/blk_td before sample with n_seq=seq
+		idx, a, b = self.skip_idx, 0, len(self.skip_idx) - 1
+		while a < b:
+			m = (a + b + 1) // 2
+			if idx[m][0] < seq: a = m
+			else: b = m - 1
+		return idx[a]
+
+	def skip_idx_t(self):
+		# Returns "time" of the latest sample, with first one being at 0 + n_td
+		s, k, t, td = self.skip_idx[-1]
+		return t + (self.n_seq - s) * td
+
+	def data_age(self):
+		# Returns ms since the latest sample, which all time offsets in data are relative to
+		# Offsets are not from "now", so that same data always produces same exports.
+		return 0 if self.n_ts is None else time.ticks_diff(time.ticks_ms(), self.n_ts)
+
+	def data_seq_td(self, seq):
+		# Returns time offset of sample with n_seq=seq (same as in data_samples_raw)
+		s, k, t, td = self.skip_idx_find(seq)
+		return self.skip_idx_t() - t - (seq - s) * td
+
+	def data_td_seq(self, td):
+		# Returns n_seq of the latest sample with time offset >= td, inverse of data_seq_td
+		idx, a, b = self.skip_idx, 0, len(self.skip_idx) - 1
+		t_max = self.skip_idx_t() - td
+		while a < b:
+			m = (a + b + 1) // 2; s, k, t, td = idx[m]
+			if t + td <= t_max: a = m
+			else: b = m - 1
+		s, k, t, td = idx[a]
+		seq = s + (t_max - t) // td
+		if a < len(idx) - 1: seq = min(seq, idx[a+1][0])
+		return min(seq, self.n_seq)
+
+	def data_range(self, td_max, td_min=0):
+		# Returns (skip, count) for samples with td_max >= time offset >= td_min
+		# td_max/td_min are offsets from "now" here, not from the latest sample.
+		age = self.data_age(); td_max, td_min = td_max - age, td_min - age
+		seq_min = self.n_seq - self.data_samples_count() + 1
+		seq_a, seq_b = max(seq_min, self.data_td_seq(td_max + 1) + 1), self.data_td_seq(td_min)
+		return self.n_seq - seq_b, max(0, seq_b - seq_a + 1)
+
+	def data_segments(self, count, skip=0):
+		# Returns [(n, td_step, td), ...] list of time-offset segments for count samples
+		#   after skip, where n is index of first sample in each (from the latest one),
+		#   td is its time offset, and td_step is added to that for every next sample.
+		# Offsets are same as in data_samples_raw, but computed from skip_idx entries.
+		td_now = self.skip_idx_t()
+		seq, n, segs = self.n_seq - skip, 0, list()
+		for s, k, t, td in reversed(self.skip_idx):
+			if n >= count: break
+			if s >= seq: continue # superseded by later entry with same n_seq
+			segs.append((n, td, td_now - t - (seq - s) * td))
+			n, seq = n + seq - s, s
+		return segs
+
+	def ts_rebase(self, ts_old, ts_new):
+		# Shifts all tracked timestamps from being relative to ts_old to ts_new
+		if self.n_ts is not None:
+			self.n_ts = time.ticks_add(ts_new, -time.ticks_diff(ts_old, self.n_ts))
+		for r in self.rollups: r.ts_rebase(ts_old, ts_new)
+
 	def data_chunks(self):
 		if not self.n: return [self.buff_mv[self.s0:]] if self.n_loops else []
 		n = self.s0 + self.n * self.sbs
@@ -515,17 +753,154 @@ class SampleRingBuffer:
 	def data_samples_count(self):
 		return (self.n_max if self.n_loops else self.n) - self.n_skips
 
-	def data_samples_raw(self):
+	def data_cursor(self): return f'{self.n_id:06x}.{self.n_seq}'
+
+	def data_cursor_seq(self, cursor):
+		# Returns n_seq value from cursor, or None if it's not valid for this buffer
+		try:
+			n_id, _, seq = cursor.partition(b'.')
+			if int(n_id, 16) == self.n_id and 0 <= (seq := int(seq)) <= self.n_seq: return seq
+		except ValueError: pass
+
+	def data_cursor_count(self, cursor):
+		# Returns number of latest samples added after cursor, or all if it's not valid
+		count = self.data_samples_count()
+		if (seq := self.data_cursor_seq(cursor)) is not None: count = min(count, self.n_seq - seq)
+		return count
+
+	def data_seek(self, skip=0):
+		# Returns (chunks, pos, td, td_step, ns) to read samples backwards from, after skip
+		# pos is an end-offset of first sample in first chunk, td is its time offset,
+		#   td_step is sampling interval before it, until next blk_td, and ns is
+		#   n_slots number after its slot, to check if it's overwritten when resuming.
+		chunks = list(reversed(self.data_chunks()))
+		td, ns = 0, self.n_slots
+		if not skip: return chunks, chunks and len(chunks[0]), td, self.n_td, ns
+		if skip >= self.data_samples_count(): return [], 0, td, self.n_td, ns
+		s, k, t, td_step = self.skip_idx_find(seq := self.n_seq - skip)
+		td += self.skip_idx_t() - t - (seq - s) * td_step
+		n = skip + self.skip_idx[-1][1] - k # slots from the latest one
+		ns -= n
+		for c, chunk in enumerate(chunks):
+			if (pos := len(chunk) - n * self.sbs) > 0: return chunks[c:], pos, td, td_step, ns
+			n -= len(chunk) // self.sbs
+		return [], 0, td, td_step, ns
+
+	def data_samples_raw(self, skip=0):
 		# Yields (offset_ms, sample_bytes) tuples in reverse-chronological order
-		# Time offsets are positive integers (from now into past), and can be irregular
-		td = time.ticks_diff(time.ticks_ms(), self.n_ts or 0)
-		for chunk in reversed(self.data_chunks()):
-			pos = len(chunk)
+		# Time offsets are positive integers (from latest sample into past), and can be irregular
+		# skip = number of latest samples to skip, jumping over those via skip_idx
+		# Stops early if remaining samples were overwritten while iteration was suspended.
+		chunks, pos, td, td_step, ns = self.data_seek(skip)
+		ns_min = self.n_slots - self.n_max
+		for c, chunk in enumerate(chunks):
+			if c: pos = len(chunk)
 			while (pos := pos - self.sbs) >= 0:
-				if chunk[pos:pos+4] != self.blk_skip:
+				if (ns := ns - 1) < ns_min: return
+				if (blk := chunk[pos:pos+4]) == self.blk_skip:
+					td += int.from_bytes(chunk[pos+4:pos+8], 'big')
+				elif blk == self.blk_td: td_step = int.from_bytes(chunk[pos+8:pos+12], 'big')
+				else:
 					yield (td, bytes(chunk[pos:pos+self.sbs]))
-					td += self.n_td
-				else: td += int.from_bytes(chunk[pos+4:pos+8], 'big')
+					td, ns_min = td + td_step, self.n_slots - self.n_max
+
+	def data_records(self, buff, skip=0, rbs=24):
+		# Fills buff with (8B double offset_ms || 16B sample) records, same as data_samples_raw,
+		#   yielding number of bytes filled in it every time it's full, and at the end.
+		# Sample bytes are copied from buffer directly, without bytes/tuple/float objects.
+		n, n_max, bs = 0, len(buff) // rbs * rbs, self.sbs
+		chunks, pos, td, td_step, ns = self.data_seek(skip)
+		ns_min = self.n_slots - self.n_max
+		for c, chunk in enumerate(chunks):
+			if c: pos = len(chunk)
+			while (pos := pos - bs) >= 0:
+				if (ns := ns - 1) < ns_min: break
+				if chunk[pos] == 0xff and 0xfd <= chunk[pos+1] <= 0xfe and not (chunk[pos+2] or chunk[pos+3]):
+					if chunk[pos+1] == 0xfe: td += int.from_bytes(chunk[pos+4:pos+8], 'big')
+					else: td_step = int.from_bytes(chunk[pos+8:pos+12], 'big')
+					continue
+				struct.pack_into('>d', buff, n, td)
+				buff[n+8:n+rbs] = chunk[pos:pos+bs]
+				if (n := n + rbs) == n_max: yield n; n, ns_min = 0, self.n_slots - self.n_max
+				td += td_step
+			else: continue
+			break
+		if n: yield n
+
+	@staticmethod
+	def records_fill(samples, buff, rbs=24):
+		# Same as data_records, but for any (offset_ms, sample_bytes) iterable
+		n, n_max = 0, len(buff) // rbs * rbs
+		for td, sample in samples:
+			struct.pack_into('>d', buff, n, td)
+			buff[n+8:n+rbs] = sample
+			if (n := n + rbs) == n_max: yield n; n = 0
+		if n: yield n
+
+	def data_samples_agg(self, n, func='mean'):
+		# Returns (count, iter) for up to n (offset_ms, sample_bytes) tuples, where
+		#   each one is an aggregate of same-size bucket of consecutive samples,
+		#   with mean/min/max of each value there, and mean time offset of the bucket.
+		# Missing values are ignored, unless all of them are missing in a bucket.
+		agg = dict(mean=lambda a, b: a + b, min=min, max=max)[func]
+		k = max(1, -(-(count := self.data_samples_count()) // max(1, n)))
+		return -(-count // k), self._data_samples_agg(k, agg, func == 'mean')
+
+	def _data_samples_agg(self, k, agg, mean):
+		fmt, nx, m = self.s_fmt, self.s_nx, 0
+		for td, sample in self.data_samples_raw():
+			if not m: td_sum, vals, vals_n = 0, list(nx), [0] * 8
+			td_sum, m = td_sum + td, m + 1
+			for c, v in enumerate(struct.unpack(fmt, sample)):
+				if v == nx[c]: continue
+				vals[c] = agg(vals[c], v) if vals_n[c] else v
+				vals_n[c] += 1
+			if m < k: continue
+			if mean: vals = list((round(v / n) if n else v) for v, n in zip(vals, vals_n))
+			yield td_sum / m, struct.pack(fmt, *vals)
+			m = 0
+		if m:
+			if mean: vals = list((round(v / n) if n else v) for v, n in zip(vals, vals_n))
+			yield td_sum / m, struct.pack(fmt, *vals)
+
+	def data_samples_lttb(self, n, key='pm25'):
+		# Returns (count, iter) for up to n (offset_ms, sample_bytes) tuples,
+		#   picked via Largest-Triangle-Three-Buckets algorithm for one of the values.
+		# Makes two passes over buffer - to get bucket averages, then to pick samples.
+		c = self.s_keys.index(key)
+		if n < 3 or (count := self.data_samples_count()) <= n:
+			return self.data_samples_count(), self.data_samples_raw()
+		return n, self._data_samples_lttb(n, count, c)
+
+	def _data_samples_lttb(self, n, count, c):
+		nb, k = n - 2, (count - 2) / (n - 2) # first/last samples are always picked
+		vfmt, nx, c = '>H' if c < 4 else '>h', self.s_nx[c], c * 2
+		b_td, b_n, b_v, b_vn = [0] * (nb + 1), [0] * (nb + 1), [0] * (nb + 1), [0] * (nb + 1)
+		b, b_end = 0, int(k) + 1
+		for i, (td, sample) in enumerate(self.data_samples_raw()):
+			if not i: continue
+			while i >= b_end and b < nb - 1: b += 1; b_end = int((b + 1) * k) + 1
+			if i == count - 1: b = nb
+			b_td[b] += td; b_n[b] += 1
+			if (v := struct.unpack_from(vfmt, sample, c)[0]) != nx: b_v[b] += v; b_vn[b] += 1
+		b, b_end, b_last, best = 0, int(k) + 1, None, None
+		for i, (td, sample) in enumerate(self.data_samples_raw()):
+			if (v := struct.unpack_from(vfmt, sample, c)[0]) == nx: v = None
+			if not i:
+				a_td, a_v = td, v
+				yield td, sample; continue
+			while i >= b_end and b < nb - 1: b += 1; b_end = int((b + 1) * k) + 1
+			if i == count - 1: b = nb
+			if b != b_last and best:
+				a_td, a_v = best[1], best[3]
+				yield best[1], best[2]
+				best = None
+			if (b_last := b) == nb:
+				yield td, sample; break
+			c_td, c_v = b_td[b+1] / b_n[b+1], b_vn[b+1] and b_v[b+1] / b_vn[b+1]
+			area = -1 if v is None else abs(
+				(a_td - c_td) * (v - (a_v or 0)) - (a_td - td) * (c_v - (a_v or 0)) )
+			if not best or area > best[0]: best = area, td, sample, v
 
 	def data_samples(self, ts_now=0):
 		# Yields (ts, sample) values, with ts = approx posix timestamp in seconds,
@@ -534,6 +909,7 @@ class SampleRingBuffer:
 		# Values are either float, or None if sensor returns N/A -
 		#   - can mean not ready yet, not supported by this model, broken hw, etc.
 		# Current timestamp to offset all samples from must be provided, or will be 0
+		ts_now -= self.data_age() / 1000
 		for td_ms, sample_raw in self.data_samples_raw():
 			yield (ts_now - (td_ms / 1000), self.s_parse(sample_raw))
 
@@ -541,80 +917,563 @@ class SampleRingBuffer:
 		return self.errs_parse(self.buff_mv[:self.s0])
 
 
+class SampleRingBufferPacked(SampleRingBuffer):
+	# Same buffer size as SampleRingBuffer, but with samples delta-encoded in fixed-size blocks
+	# Each block has 2B used-bytes + 2B sample-count header and a list of records,
+	#   where first sample record in a block is encoded as delta from all-zero values.
+	# Sample record: 1B changed-values bitmask + zigzag-varint delta for each changed value.
+	# Time-skip record: 0xff 0x00 (impossible sample prefix) + 4B skipped time-delta ms.
+	# Interval-change record: 0xff 0x80 0x00 (non-minimal zero varint) + 4B new + 4B old td.
+	# Blocks are replaced as a whole, and each one is decoded to reverse it when reading.
+
+	bbs, rec_skip, rec_td = 256, b'\xff\0', b'\xff\x80\0' # block size, record prefixes
+
+	def __init__(self, td_ms, count):
+		super().__init__(td_ms, count)
+		if (n := (len(self.buff) - self.s0) // self.bbs) < 2:
+			raise ValueError(f'Sample count too low for packed buffer: {count}')
+		self.b_max, self.smv = n, memoryview(bytearray(self.sbs))
+		self.rec = bytearray(1 + 3 * 8) # bitmask + max-size varint for each value
+		self.b = self.n_count = self.n_blocks = 0 # n_blocks = same as n_slots
+		self.block_init()
+
+	def block_init(self):
+		pos = self.s0 + self.b * self.bbs
+		self.n_count -= int.from_bytes(self.buff[pos+2:pos+4], 'big')
+		self.buff[pos:pos+4] = bytes(4)
+		self.skip_idx_trim()
+		self.b_pos, self.b_vals = pos + 4, [0] * 8
+
+	def block_add(self, rec_n, sample=False):
+		# Copies rec_n bytes from self.rec into current block, returns position of it
+		pos, bs = self.b_pos, rec_n
+		self.buff[pos:pos+bs] = self.rec[:bs]
+		self.b_pos, pos_b = pos + bs, self.s0 + self.b * self.bbs
+		self.buff[pos_b:pos_b+2] = (self.b_pos - pos_b - 4).to_bytes(2, 'big')
+		if sample:
+			self.n_count += 1
+			n = int.from_bytes(self.buff[pos_b+2:pos_b+4], 'big') + 1
+			self.buff[pos_b+2:pos_b+4] = n.to_bytes(2, 'big')
+		return pos
+
+	def block_fits(self, rec_n):
+		if self.b_pos + rec_n <= self.s0 + (self.b + 1) * self.bbs: return True
+		self.b, self.n_blocks = (self.b + 1) % self.b_max, self.n_blocks + 1
+		if not self.b: self.n_loops += 1
+		self.block_init()
+
+	def rec_encode(self, sample):
+		# Encodes sample as delta from b_vals into self.rec, returns its length
+		rec, vals, n, mask = self.rec, self.b_vals, 1, 0
+		for c, v in enumerate(struct.unpack('>HHHHHHHH', sample)):
+			if not (d := (v - vals[c]) & 0xffff): continue
+			vals[c], mask = v, mask | (1 << c)
+			if d & 0x8000: d -= 0x10000
+			d = (d << 1) ^ (d >> 15) # zigzag
+			while d > 0x7f: rec[n] = (d & 0x7f) | 0x80; d >>= 7; n += 1
+			rec[n] = d; n += 1
+		rec[0] = mask
+		return n
+
+	def sample_mv(self, ts):
+		if self.n_ts is not None and (
+				td := time.ticks_diff(ts, self.n_ts) - self.n_td ) > self.n_td:
+			self.sample_mv_commit(ts, td)
+		return self.smv
+
+	def sample_mv_commit(self, ts, td_skip=None):
+		if td_skip:
+			if pos := self.skip_last_pos:
+				td_skip += self.n_td + (td := int.from_bytes(self.buff[pos+2:pos+6], 'big'))
+			else:
+				self.rec[:2], td = self.rec_skip, None
+				self.block_fits(6)
+				pos = self.skip_last_pos = self.block_add(6)
+			if td_skip > 0xffffffff: # >50d delta = overflow - flush all old data
+				for pos in range(self.s0, self.s0 + self.b_max * self.bbs, self.bbs):
+					self.buff[pos:pos+4] = bytes(4)
+				self.n_ts = self.skip_last_pos = self.td_last_pos = None
+				self.b = self.n_loops = self.n_count = 0; self.n_blocks += self.b_max
+				self.skip_idx = [(self.n_seq, 0, 0, self.n_td)]; self.block_init(); return
+			self.buff[pos+2:pos+6] = td_skip.to_bytes(4, 'big')
+			self.skip_idx_add(td_skip, td)
+			self.td_last_pos = None
+		else:
+			if not self.block_fits(n := self.rec_encode(self.smv)):
+				n = self.rec_encode(self.smv) # new block, re-encoded from all-zero values
+			self.block_add(n, sample=True)
+			self.skip_last_pos = self.td_last_pos = None
+			self.n_seq += 1
+			self.n_ev.set()
+			for r in self.rollups: r.add(ts, self.smv)
+			if self.log: self.log.add(ts, self.smv)
+		self.n_ts = ts
+
+	def sample_td_set(self, td_ms):
+		if td_ms == self.n_td: return
+		if not (pos := self.td_last_pos):
+			self.rec[:3], self.rec[7:11] = self.rec_td, self.n_td.to_bytes(4, 'big')
+			self.block_fits(11)
+			pos = self.td_last_pos = self.block_add(11)
+			self.skip_idx_td(td_ms)
+			self.skip_last_pos = None
+		else: self.skip_idx_td(td_ms, True)
+		self.buff[pos+3:pos+7] = td_ms.to_bytes(4, 'big')
+		self.n_td = td_ms
+
+	def block_decode(self, pos):
+		# Returns list of sample-bytes and skip-ms values from block at pos in buffer
+		# Interval changes are returned as negative old-interval values in the same list.
+		recs, vals, buff = list(), [0] * 8, self.buff
+		pos, end = pos + 4, pos + 4 + int.from_bytes(buff[pos:pos+2], 'big')
+		while pos < end:
+			if buff[pos] == 0xff: # all-values-changed sample or skip/interval record
+				if buff[pos:pos+2] == self.rec_skip:
+					recs.append(int.from_bytes(buff[pos+2:pos+6], 'big')); pos += 6; continue
+				if buff[pos:pos+3] == self.rec_td:
+					recs.append(-int.from_bytes(buff[pos+7:pos+11], 'big')); pos += 11; continue
+			mask, pos = buff[pos], pos + 1
+			for c in range(8):
+				if not mask & (1 << c): continue
+				d = bits = 0
+				while True:
+					d |= ((b := buff[pos]) & 0x7f) << bits; pos += 1; bits += 7
+					if not b & 0x80: break
+				vals[c] = (vals[c] + ((d >> 1) ^ -(d & 1))) & 0xffff
+			recs.append(struct.pack('>HHHHHHHH', *vals))
+		return recs
+
+	def data_samples_count(self): return self.n_count
+
+	def data_records(self, buff, skip=0):
+		return self.records_fill(self.data_samples_raw(skip), buff)
+
+	def data_samples_raw(self, skip=0):
+		# Skips whole blocks by their sample counts, with time offset from skip_idx after that
+		seq, seek, td_step, nb = self.n_seq, False, self.n_td, self.n_blocks
+		td = None if skip else 0
+		blocks = list(range(self.b, -1, -1))
+		if self.n_loops: blocks.extend(range(self.b_max - 1, self.b, -1))
+		for c, b in enumerate(blocks):
+			if nb - c <= self.n_blocks - self.b_max: return # overwritten since last yield
+			pos = self.s0 + b * self.bbs
+			if skip and skip >= (n := int.from_bytes(self.buff[pos+2:pos+4], 'big')):
+				skip, seq = skip - n, seq - n; continue
+			if td is None:
+				td, td_step, seek = self.data_seq_td(seq), self.skip_idx_find(seq)[3], True
+			for rec in reversed(self.block_decode(pos)):
+				if isinstance(rec, int):
+					if seek: continue
+					if rec < 0: td_step = -rec
+					else: td += rec
+				else:
+					if skip: skip -= 1
+					else: yield (td, rec)
+					td, seek = td + td_step, False
+
+
+class SampleAdaptive:
+	# Picks sampling interval after each sample - td_fast when PM/VOC values have changed
+	#   by more than delta thresholds since reference sample, which is updated at td_slow
+	#   intervals, and back to td_slow after td_hold ms without any such changes.
+
+	def __init__(self, td_slow, td_fast, td_hold, pm_delta, voc_delta):
+		self.td_slow, self.td_fast, self.td_hold = td_slow, td_fast, td_hold
+		self.deltas = ( # delta thresholds for raw values, same as in ring buffer
+			(1, int(pm_delta * 10)), (3, int(pm_delta * 10)), (6, int(voc_delta * 10)) )
+		self.ref = self.ts_ref = self.ts_change = None
+
+	def __call__(self, ts, sample, fmt=SampleRingBuffer.s_fmt, nx=SampleRingBuffer.s_nx):
+		vals = struct.unpack(fmt, sample)
+		if ref := self.ref:
+			for c, d in self.deltas:
+				if vals[c] == nx[c] or ref[c] == nx[c] or abs(vals[c] - ref[c]) <= d: continue
+				self.ts_change = ts; break
+		if not ref or time.ticks_diff(ts, self.ts_ref) >= self.td_slow - self.td_fast // 2:
+			self.ref, self.ts_ref = vals, ts
+		if self.ts_change is None: return self.td_slow
+		if time.ticks_diff(ts, self.ts_change) < self.td_hold: return self.td_fast
+		self.ts_change = None; return self.td_slow
+
+
+class SampleRollup:
+	# Aggregates samples added to SampleRingBuffer over longer td_ms intervals,
+	#   storing avg/min/max values for each into separate ring buffers (srbs),
+	#   which share the lock with main one, as they're only updated on its commits.
+	# Interval is stored in ring buffers when first sample after its end is added.
+
+	def __init__(self, name, td_ms, count, lock):
+		self.name, self.td, self.ts0 = name, td_ms, None
+		self.srbs = dict((k, SampleRingBuffer(td_ms, count)) for k in ['avg', 'min', 'max'])
+		for srb in self.srbs.values(): srb.lock = lock
+		self.v_n, self.v_sum, self.v_min, self.v_max = [0] * 8, [0] * 8, [0] * 8, [0] * 8
+
+	def add(self, ts, sample, fmt=SampleRingBuffer.s_fmt, nx=SampleRingBuffer.s_nx):
+		if self.ts0 is None: self.ts0 = ts
+		elif (td := time.ticks_diff(ts, self.ts0)) >= self.td:
+			self.commit(time.ticks_add(self.ts0, self.td))
+			self.ts0 = ts if td >= 2 * self.td else time.ticks_add(self.ts0, self.td)
+		for c, v in enumerate(struct.unpack(fmt, sample)):
+			if v == nx[c]: continue
+			if not self.v_n[c]: self.v_sum[c] = self.v_min[c] = self.v_max[c] = v
+			else:
+				self.v_sum[c] += v
+				if v < self.v_min[c]: self.v_min[c] = v
+				elif v > self.v_max[c]: self.v_max[c] = v
+			self.v_n[c] += 1
+
+	def commit(self, ts, fmt=SampleRingBuffer.s_fmt, nx=SampleRingBuffer.s_nx):
+		vals = dict(
+			avg=list((round(v / n) if n else x) for v, n, x in zip(self.v_sum, self.v_n, nx)),
+			min=list((v if n else x) for v, n, x in zip(self.v_min, self.v_n, nx)),
+			max=list((v if n else x) for v, n, x in zip(self.v_max, self.v_n, nx)) )
+		for k, srb in self.srbs.items():
+			struct.pack_into(fmt, srb.sample_mv(ts), 0, *vals[k])
+			srb.sample_mv_commit(ts)
+		for c in range(8): self.v_n[c] = 0
+
+	def ts_rebase(self, ts_old, ts_new):
+		if self.ts0 is not None:
+			self.ts0 = time.ticks_add(ts_new, -time.ticks_diff(ts_old, self.ts0))
+		for srb in self.srbs.values(): srb.ts_rebase(ts_old, ts_new)
+
+
+class SampleLog:
+	# Append-only log of samples committed to SampleRingBuffer on flash,
+	#   used to restore those after reset/power-cycle, instead of starting empty.
+	# Records are 4B ms-delta from previous sample + 16B sample, where delta
+	#   is td_nx for first sample after boot, as time spent offline is unknown.
+	# Records are buffered in RAM and appended to files in batches,
+	#   to avoid frequent small flash writes, switching to a new numbered
+	#   "<n>.log" segment-file when last one is over seg_bs in size,
+	#   and removing oldest ones to only keep seg_count segments in total.
+
+	rbs, td_nx = 4 + SampleRingBuffer.sbs, 0xffffffff
+
+	def __init__(self, path, batch, seg_bs, seg_count, verbose=False):
+		self.p_log = verbose and (lambda *a: print('[sample-log]', *a))
+		self.path, self.seg_bs, self.seg_count = path.rstrip('/'), seg_bs, seg_count
+		self.buff = bytearray(self.rbs * batch); self.buff_mv = memoryview(self.buff)
+		self.n, self.ts = 0, None
+		try: os.mkdir(self.path)
+		except OSError: pass # already exists
+		self.seg = (segs := self.segments()) and segs[-1] or 0
+
+	def segments(self):
+		return sorted( int(fn[:-4]) for fn in os.listdir(self.path)
+			if fn.endswith('.log') and fn[:-4].isdigit() )
+	def seg_path(self, seg): return f'{self.path}/{seg}.log'
+
+	def add(self, ts, sample):
+		pos, td = self.n * self.rbs, self.td_nx if self.ts is None else time.ticks_diff(ts, self.ts)
+		self.buff[pos:pos+4] = td.to_bytes(4, 'big')
+		self.buff[pos+4:pos+self.rbs] = sample
+		self.ts, self.n = ts, self.n + 1
+		if self.n * self.rbs >= len(self.buff): self.flush()
+
+	def flush(self):
+		if not self.n: return
+		try:
+			try: seg_bs = os.stat(p := self.seg_path(self.seg))[6]
+			except OSError: seg_bs = 0
+			if seg_bs >= self.seg_bs:
+				p, self.seg = self.seg_path(self.seg + 1), self.seg + 1
+				for seg in self.segments():
+					if seg > self.seg - self.seg_count: break
+					self.p_log and self.p_log(f'Removing old segment: {seg}')
+					os.remove(self.seg_path(seg))
+			with open(p, 'ab') as dst: dst.write(self.buff_mv[:self.n * self.rbs])
+		except OSError as err: p_err(f'[sample-log] Failed to write samples: {err_fmt(err)}')
+		self.n = 0
+
+	def restore(self, srb, count, tds=None):
+		# Replays up to count last logged samples into srb, returns number of those
+		# Should be called before any add() calls, as it reuses buffer for reading files.
+		# tds = sampling intervals to set in srb, when logged time-deltas are close to those.
+		segs, n = list(), 0
+		for seg in reversed(self.segments()):
+			segs.append((p := self.seg_path(seg), recs := os.stat(p)[6] // self.rbs))
+			if (n := n + recs) >= count: break
+		skip, log, srb.log = max(0, n - count), srb.log, None
+		n -= skip
+		ts = ts0 = time.ticks_ms()
+		try:
+			for p, recs in reversed(segs):
+				with open(p, 'rb') as src:
+					if skip: src.seek((m := min(skip, recs)) * self.rbs); skip -= m
+					while bs := src.readinto(self.buff):
+						for pos in range(0, bs - self.rbs + 1, self.rbs):
+							td = int.from_bytes(self.buff[pos:pos+4], 'big')
+							if tds and td != self.td_nx:
+								for td_srb in tds:
+									if abs(td - td_srb) * 8 < td_srb: srb.sample_td_set(td_srb); break
+							ts = time.ticks_add(ts, srb.n_td if td == self.td_nx else td)
+							srb.sample_mv(ts)[:] = self.buff_mv[pos+4:pos+self.rbs]
+							srb.sample_mv_commit(ts)
+		finally: srb.log = log
+		srb.ts_rebase(ts, time.ticks_ms())
+		self.p_log and self.p_log( f'Restored {n:,d} sample(s)'
+			f' from {len(segs)} segment(s) in {time.ticks_diff(time.ticks_ms(), ts0):,d} ms' )
+		return n
+
+
 class WebUI:
 
+	req_body_handlers = {('data_marks', b'put')} # (handler, verb) that read request body
+	cols_magic = b'\xff\xffAQ' # NaN as 8Bms_16Bsen5x_tuples time offset, to tell formats apart
+
 	class Req:
-		prefix, cache_gen, etag, bs = '', 0, b'-no-header-', 0
+		prefix, cache_gen, etag, bs, conn, enc, keep = '', 0, b'-no-header-', 0, b'', b'', False
+		range = if_range = last_id = buff = gz = chunked = None
 		mime_types = dict(js='text/javascript', ico='image/vnd.microsoft.icon')
-		def __init__(self, **kws): self.update(**kws)
+		def __init__(self, **kws): self.qs = dict(); self.update(**kws)
 		def update(self, **kws):
 			for k,v in kws.items(): setattr(self, k, v)
 
+	class ReqOut:
+		# Response stream wrapper, raising TimeoutError if any drain() takes too long
+		def __init__(self, sout, timeout): self.sout, self.write, self.timeout = sout, sout.write, timeout
+		def drain(self): return asyncio.wait_for(self.sout.drain(), self.timeout)
+
+	class ReqOutGzip:
+		# Response stream wrapper, compressing data via deflate module into gzip format
+		# DeflateIO writes into BytesIO, which is sent and rewound on every drain().
+		def __init__(self, sout, wbits):
+			self.sout, self.bio = sout, io.BytesIO()
+			self.gz = deflate.DeflateIO(self.bio, deflate.GZIP, wbits)
+			self.write = self.gz.write
+		def flush(self):
+			if n := self.bio.tell():
+				self.sout.write(memoryview(self.bio.getvalue())[:n]); self.bio.seek(0)
+		def drain(self): self.flush(); return self.sout.drain()
+		def close(self): self.gz.close(); self.flush()
+
+	class ReqOutChunked:
+		# Response stream wrapper, sending every write() as HTTP/1.1 chunk
+		def __init__(self, sout): self.sout, self.drain = sout, sout.drain
+		def write(self, buff):
+			if not (n := len(buff)): return # empty chunk ends response
+			self.sout.write(f'{n:x}\r\n'.encode()); self.sout.write(buff); self.sout.write(b'\r\n')
+		def close(self): self.sout.write(b'0\r\n\r\n')
+
 	def __init__( self, srb, verbose=False,
 			page_title=AQMConf.webui_title,
 			url_prefix=AQMConf.webui_url_prefix,
 			d3_api=AQMConf.webui_d3_api,
 			d3_remote=AQMConf.webui_d3_load_from_internet,
 			marks_bs_max=AQMConf.webui_marks_storage_bytes,
-			fan_clean_func_iter=val_iter() ):
-		self.srb, self.verbose = srb, verbose
-		self.req_n, self.req_lock = 0, asyncio.Lock()
+			data_poll=AQMConf.webui_data_poll, data_poll_td=None,
+			data_live_clients=AQMConf.webui_data_live_clients,
+			data_live_timeout=AQMConf.webui_data_live_timeout,
+			graph_points=AQMConf.webui_graph_points,
+			graph_points_func=AQMConf.webui_graph_points_func,
+			buffers=AQMConf.webui_buffers,
+			buffer_size=AQMConf.webui_buffer_size,
+			buffer_wait=AQMConf.webui_buffer_wait,
+			gzip_window_bits=AQMConf.webui_gzip_window_bits,
+			conn_requests=AQMConf.webui_conn_requests,
+			conn_idle_timeout=AQMConf.webui_conn_idle_timeout,
+			conn_per_peer=AQMConf.webui_conn_per_peer,
+			read_timeout=AQMConf.webui_read_timeout,
+			write_timeout=AQMConf.webui_write_timeout,
+			header_max_bytes=AQMConf.webui_header_max_bytes,
+			fan_clean_func_iter=val_iter(), stats=None ):
+		self.srb, self.verbose, self.data_poll, self.req_n = srb, verbose, data_poll, 0
+		self.data_poll_td = data_poll_td or srb.n_td # configured interval, not adaptive one
+		self.stats = stats
 		self.d3_api, self.d3_remote = d3_api, d3_remote
 		self.url_prefix, self.url_strip = url_prefix, url_prefix.encode()
-		self.buff = bytearray(2048); self.buff_mv = memoryview(self.buff)
+		# Pool of transfer buffers, one per concurrently-handled request
+		self.buffs = list(memoryview(bytearray(max(128, buffer_size))) for n in range(max(1, buffers)))
+		self.buffs_ev, self.buffs_wait = asyncio.Event(), buffer_wait
+		self.gzip_wbits = gzip_window_bits and self.gzip_check(gzip_window_bits)
+		self.conn_reqs, self.conn_idle = max(1, conn_requests), conn_idle_timeout
+		self.conn_peers, self.conn_peer_max = dict(), max(0, conn_per_peer) # {ip: count}
+		self.read_timeout, self.write_timeout = read_timeout, write_timeout
+		self.head_bs_max, self.rejects = header_max_bytes, dict() # {reason: count}
+		self.live_n, self.live_max, self.live_timeout = 0, data_live_clients, data_live_timeout
 		self.marks, self.marks_bs_max = None, marks_bs_max
+		self.page_key, self.page_body, self.page_gen = None, b'', 0 # pre-rendered index page
+		self.metrics, self.metrics_key, self.ts_start = None, None, time.time()
 		self.page_title, self.act_fan_clean_iter = page_title, fan_clean_func_iter
 		self.req_url_map = dict(
 			page_index=(b'/', b'/index.html', b'/index.htm'), favicon=(b'/favicon.ico',),
 			js=(b'/webui.js',), js_d3=(f'/d3.v{self.d3_api}.min.js'.encode(),),
 			data_csv=(b'/data/all/latest-first/samples.csv',),
 			data_bin=(b'/data/all/latest-first/samples.8Bms_16Bsen5x_tuples.bin',),
+			data_cols=(b'/data/all/latest-first/samples.v2_int16_columns.bin',),
 			data_raw=(b'/data/all/latest-first/samples.debug.raw',),
-			data_marks=(b'/data/marks.bin',), act_fan_clean=(b'/fan-clean',) )
+			data_since=(b'/data/since/latest-first/samples.8Bms_16Bsen5x_tuples.bin',),
+			data_agg=(b'/data/agg/latest-first/samples.8Bms_16Bsen5x_tuples.bin',),
+			data_range=( b'/data/range',
+				b'/data/range/latest-first/samples.8Bms_16Bsen5x_tuples.bin' ),
+			data_range_csv=(b'/data/range/latest-first/samples.csv',),
+			data_live=(b'/data/live/samples.8Bms_16Bsen5x_tuples.hex.sse',),
+			data_marks=(b'/data/marks.bin',), act_fan_clean=(b'/fan-clean',),
+			metrics=(b'/metrics',) )
+		if stats: self.req_url_map['debug_stats'] = (b'/debug/stats.json',)
 		self.req_url_links = dict(( k, self.url_prefix +
 			url[0].decode().lstrip('/') ) for k, url in self.req_url_map.items())
-		self.req_url_locks = dict.fromkeys(
-			['data_csv', 'data_bin', 'data_raw'], self.srb.lock )
+		self.req_url_links['data_graph'] = self.req_url_links['data_cols'] if not graph_points else (
+			f'{self.req_url_links["data_agg"]}?n={graph_points}&f={graph_points_func}' )
+		if not (data_poll and data_live_clients): self.req_url_links['data_live'] = ''
 
 	async def request(self, sin, sout):
-		try: await self._request(sin, sout)
+		# Handles up to conn_reqs HTTP/1.1 keep-alive requests on same connection
+		peer, out = (sin.get_extra_info('peername') or ('',))[0], self.ReqOut(sout, self.write_timeout)
+		try:
+			if (n := self.conn_peers.get(peer, 0)) >= self.conn_peer_max > 0:
+				req = self.Req(sout=out, proto=b'HTTP/1.1', log=self.verbose and print)
+				return await self.res_reject(req, 429, 'peer_limit', peer)
+			self.conn_peers[peer] = n + 1
+			try:
+				for n in range(self.conn_reqs):
+					if not await self._request(sin, out, n, n < self.conn_reqs - 1): break
+			finally:
+				if n := self.conn_peers.pop(peer) - 1: self.conn_peers[peer] = n
 		finally:
 			sin.close(); sout.close()
 			await asyncio.gather(sin.wait_closed(), sout.wait_closed())
 
-	async def _request(self, sin, sout):
+	async def _request(self, sin, sout, n=0, keep=False):
+		# Returns True if connection can be kept open for next request
+		# Request line and headers are read before getting transfer buffer,
+		#   within read_timeout and header_max_bytes limits, so slow clients can't hog those.
 		self.req_n += 1
 		req = self.Req( sin=sin, sout=sout, url_map=self.req_url_map,
-			url_links=self.req_url_links, url_locks=self.req_url_locks,
+			url_links=self.req_url_links, keep=keep,
 			log=self.verbose and (lambda *a,_pre=f'[http.{self.req_n:03d}]': print(_pre, *a)) )
-		req.log and req.log('Connected:', req.sin.get_extra_info('peername'))
-		line = (await sin.readline()).strip()
+		if not n: req.log and req.log('Connected:', req.sin.get_extra_info('peername'))
+		try: line = await asyncio.wait_for(sin.readline(), self.conn_idle)
+		except asyncio.TimeoutError: # idle keep-alive connection, or nothing sent at all
+			return not n and self.req_reject(req, 'idle')
+		if not (line := line.strip()): return
 		try: req.verb, req.url, req.proto = line.split(None, 2)
-		except ValueError: return req.log and req.log('Req non-http line:', line)
+		except ValueError: return self.req_reject(req, 'bad_request', line)
 		req.log and req.log(f'Request: {req.verb.decode()} {req.url.decode()}')
 		if self.url_strip and req.url.startswith(self.url_strip):
 			req.url = req.url[len(self.url_strip):]
-		await self.req_lock.acquire() # avoids transfer-buffer clashes
-		try: await self.req_handler(req)
+		try:
+			if not await asyncio.wait_for(self.req_headers(req, len(line)), self.read_timeout):
+				return await self.res_reject(req, 431, 'header_size')
+		except asyncio.TimeoutError: return self.req_reject(req, 'header_timeout')
+		except ValueError: return self.req_reject(req, 'bad_request', 'invalid header value')
+		if stats := self.stats: ts = time.ticks_ms()
+		buff = await self.buff_get()
+		stats and stats.td('lock_wait', 'buffer', ts)
+		if not buff:
+			return await self.res_reject(req, 503, 'buffer_wait')
+		try: req.buff = buff; await self.req_handler(req)
 		except Exception as err:
+			req.keep = False
 			if isinstance(err, OSError) and err.errno == 104: pass # ECONNRESET
+			elif isinstance(err, asyncio.TimeoutError): self.req_reject(req, 'timeout')
 			else: req.log and req.log(f'Request-exc: {err_fmt(err)}')
-		finally: self.req_lock.release()
+		finally: self.buff_release(req)
+		return req.keep
+
+	async def req_headers(self, req, bs=0):
+		# Parses request headers, returns False if those are over head_bs_max in size
+		while line := (await req.sin.readline()):
+			if (bs := bs + len(line)) > self.head_bs_max: return False
+			if not (line := line.strip()): break
+			k, _, v = line.partition(b':')
+			if (k := k.strip().lower()) == b'if-none-match': req.etag = v.strip()
+			elif k == b'content-length': req.bs = int(v)
+			elif k == b'connection': req.conn = v.strip().lower()
+			elif k == b'accept-encoding': req.enc = v.strip().lower()
+			elif k == b'range': req.range = v.strip()
+			elif k == b'if-range': req.if_range = v.strip()
+			elif k == b'last-event-id': req.last_id = v.strip()
+		return True
 
-	def res_err(self, req, code, msg={
+	def req_reject(self, req, reason, info=''):
+		# Counts and logs requests/connections that were dropped before handling those
+		self.rejects[reason] = self.rejects.get(reason, 0) + 1
+		self.stats and self.stats.inc('http_reject', reason)
+		req.log and req.log(f'Rejected [{reason}]', info)
+
+	async def res_reject(self, req, status, reason, info=''):
+		# Counts rejected request, then sends error response, counting write timeout on it too
+		self.req_reject(req, reason, info)
+		req.keep = False; self.res_err(req, status)
+		try: await req.sout.drain()
+		except asyncio.TimeoutError: self.req_reject(req, 'timeout', 'error response')
+		except OSError: pass # ECONNRESET and such
+
+	def res_head(self, req, status):
+		req.sout.write(b'HTTP/1.1 ' + status + b'\r\nServer: aqm\r\n')
+		if not req.keep: req.sout.write(b'Connection: close\r\n')
+		elif req.proto != b'HTTP/1.1': req.sout.write(b'Connection: keep-alive\r\n')
+
+	async def buff_get(self):
+		# Returns transfer buffer from the pool, waiting for buffs_wait seconds if all in use
+		ts = time.ticks_ms()
+		while not self.buffs:
+			td = self.buffs_wait - time.ticks_diff(time.ticks_ms(), ts) / 1000
+			if td <= 0: return
+			self.buffs_ev.clear()
+			try: await asyncio.wait_for(self.buffs_ev.wait(), td)
+			except asyncio.TimeoutError: pass
+		return self.buffs.pop()
+
+	def buff_release(self, req):
+		if not req.buff: return
+		self.buffs.append(req.buff); self.buffs_ev.set(); req.buff = None
+
+	@staticmethod
+	def gzip_check(wbits):
+		# Returns wbits if deflate module is there and can compress data, None otherwise
+		try: deflate.DeflateIO(io.BytesIO(), deflate.GZIP, wbits).write(b'')
+		except (AttributeError, OSError, ValueError): return # no module or compression support
+		return wbits
+
+	def req_gzip(self, req, sized=True):
+		# Returns True if response can be gzip-compressed, to pass to res_body() after headers
+		# sized=False is for responses without Content-Length known in advance.
+		# Such responses are sent in chunks, or with keep-alive disabled for non-HTTP/1.1 clients.
+		gz = bool(self.gzip_wbits and b'gzip' in req.enc)
+		if (gz or not sized) and req.proto != b'HTTP/1.1': req.keep = False
+		return gz
+
+	def res_body(self, req, gz=False, bs=None):
+		# Ends headers with Content-Length, or switches req.sout to chunked and/or gzip encoding
+		if self.gzip_wbits: req.sout.write(b'Vary: Accept-Encoding\r\n')
+		if not gz and bs is not None:
+			return req.sout.write(f'Content-Length: {bs}\r\n\r\n'.encode())
+		if gz: req.sout.write(b'Content-Encoding: gzip\r\n')
+		if req.proto == b'HTTP/1.1':
+			req.sout.write(b'Transfer-Encoding: chunked\r\n\r\n')
+			req.sout = req.chunked = self.ReqOutChunked(req.sout)
+		else: req.sout.write(b'\r\n')
+		if gz: req.sout = req.gz = self.ReqOutGzip(req.sout, self.gzip_wbits)
+
+	def res_end(self, req):
+		# Finishes gzip and chunked encodings of response body, if any were used
+		if req.gz: req.gz.close()
+		if req.chunked: req.chunked.close()
+
+	def res_err(self, req, code, headers=b'', msg={
 			400: 'Bad Request', 405: 'Method Not Allowed',
-			413: 'Payload Too Large', 404: 'Not Found', 429: 'Too many requests' }):
+			413: 'Payload Too Large', 404: 'Not Found', 429: 'Too many requests',
+			431: 'Request Header Fields Too Large',
+			416: 'Range Not Satisfiable', 503: 'Service Unavailable' }):
 		if isinstance(msg, dict): msg = msg.get(code, '')
 		req.log and req.log(f'Response: http-error-{code} [{msg or "-"}]')
-		req.sout.write(f'HTTP/1.0 {code} {msg}\r\n'.encode())
+		self.stats and self.stats.inc('http_err', code)
+		self.res_head(req, f'{code} {msg}'.encode())
 		body = ( f'HTTP Error [{code}]: {msg}\n'
 			if msg else f'HTTP Error [{code}]\n' ).encode()
-		req.sout.write(b'Server: aqm\r\nContent-Type: text/plain\r\n')
+		req.sout.write(b'Content-Type: text/plain\r\n' + headers)
 		req.sout.write(f'Content-Length: {len(body)}\r\n\r\n'.encode())
 		req.sout.write(body)
 
-	def res_ok(self, req, cache=None):
+	def res_ok(self, req, cache=None, revalidate=False, range_bs=None, headers=b''):
+		# cache = ETag source string, revalidate = add no-cache to always check ETag
+		# range_bs = full response size, to return (start, end) offsets for Range requests
+		# headers are also sent with 304 responses, to update those in client's cache
 		if req.verb != b'get': return self.res_err(req, 405)
+		etag = None
 		if cache:
 			etag = 0xcbf29ce484222325 # 64b FNV-1a hash
 			for b in f'{req.cache_gen}.{cache}'.encode():
@@ -622,15 +1481,38 @@ class WebUI:
 			etag = f'"{etag.to_bytes(8, "big").hex()}"'.encode()
 			if etag == req.etag:
 				req.log and req.log(f'ETag-cache-match-304: {etag.decode()}')
-				req.sout.write(b'HTTP/1.0 304 Not Modified\r\nServer: aqm\r\n\r\n')
+				self.res_head(req, b'304 Not Modified'); req.sout.write(headers + b'\r\n')
 				return
-		req.sout.write(b'HTTP/1.0 200 OK\r\nServer: aqm\r\n')
-		if not cache: req.sout.write(b'Cache-Control: no-cache\r\n')
-		else:
+		if rng := range_bs is not None and self.req_range(req, range_bs, etag):
+			if rng[0] > rng[1]:
+				return self.res_err(req, 416, f'Content-Range: bytes */{range_bs}\r\n'.encode())
+			req.log and req.log(f'Range: {rng[0]}-{rng[1]} / {range_bs}')
+			self.res_head(req, b'206 Partial Content')
+			req.sout.write(f'Content-Range: bytes {rng[0]}-{rng[1]}/{range_bs}\r\n'.encode())
+		else: self.res_head(req, b'200 OK')
+		if headers: req.sout.write(headers)
+		if range_bs is not None: req.sout.write(b'Accept-Ranges: bytes\r\n')
+		if not cache or revalidate: req.sout.write(b'Cache-Control: no-cache\r\n')
+		if cache:
 			req.log and req.log( 'ETag-cache-miss:'
 				f' {etag.decode()} (data) vs {req.etag.decode()} (request)' )
 			req.sout.write(b'ETag: ' + etag + b'\r\n')
-		return True
+		return rng or True
+
+	def req_range(self, req, bs, etag):
+		# Returns (start, end) offsets for single "bytes=" range (start > end if unsatisfiable)
+		# None is returned for missing/invalid/unsupported ranges, or If-Range mismatch.
+		if not req.range or (req.if_range and req.if_range != etag): return
+		unit, _, spec = req.range.partition(b'=')
+		if unit.strip().lower() != b'bytes' or b',' in spec: return
+		try:
+			a, _, b = spec.strip().partition(b'-')
+			if b.startswith(b'-'): return # invalid, e.g. "bytes=--5"
+			if not a: a, b = max(0, bs - int(b)), bs - 1
+			else: a, b = int(a), min(bs - 1, int(b) if b else bs - 1)
+		except ValueError: return
+		if a >= bs: return bs, bs - 1
+		if a <= b: return a, b
 
 	async def res_static(self, req, p):
 		if req.verb != b'get': return self.res_err(req, 405)
@@ -642,56 +1524,76 @@ class WebUI:
 		else: return self.res_err(req, 404)
 		src_mtime, src_bs = os.stat(p)[-1], src.seek(0, 2) # SEEK_END
 		if not self.res_ok(req, f'{p}.{src_mtime}.{src_bs}'): return
-		req.sout.write(
-			b'Content-Type: {mime}\r\nContent-Length: {bs}\r\n{enc}'
-			.format( mime=mime, bs=src_bs,
-				enc='Content-Encoding: gzip\r\n\r\n' if p.endswith('.gz') else '\r\n' ) )
+		req.sout.write((
+			f'Content-Type: {mime}\r\nContent-Length: {src_bs}\r\n'
+			+ ('Content-Encoding: gzip\r\n\r\n' if p.endswith('.gz') else '\r\n') ).encode())
 		src.seek(0)
 		while True:
-			if n := src.readinto(self.buff_mv):
-				req.sout.write(self.buff_mv[:n])
+			if n := src.readinto(req.buff):
+				req.sout.write(req.buff[:n])
 				await req.sout.drain()
 			if src.tell() >= src_bs: break
 
 	async def req_handler(self, req):
 		req.ts, req.verb = time.ticks_ms(), req.verb.lower()
+		req.url, _, qs = req.url.partition(b'?')
 		while b'//' in req.url: req.url = req.url.replace(b'//', b'/')
-		while line := (await req.sin.readline()).strip():
-			k, _, v = line.partition(b':')
-			if (k := k.strip().lower()) == b'if-none-match': req.etag = v.strip()
-			elif k == b'content-length': req.bs = int(v)
+		for kv in qs.split(b'&'):
+			if kv: k, _, v = kv.partition(b'='); req.qs[k] = v
+		if req.conn == b'close' or (req.proto != b'HTTP/1.1' and req.conn != b'keep-alive'):
+			req.keep = False # not requested
 		for k, k_url in req.url_map.items():
 			if req.url not in k_url: continue
 			req.log and req.log(f'Handler: {k}')
-			if lock := req.url_locks.get(k): await lock.acquire()
-			try: await getattr(self, f'req_{k}')(req)
-			finally:
-				if lock: lock.release()
+			if req.bs and (k, req.verb) not in self.req_body_handlers:
+				req.keep = False # request body won't be read
+			if not (srb := self.req_srb(req)): self.res_err(req, 400); break
+			req.srb = srb
+			await getattr(self, f'req_{k}')(req)
 			break
-		else: self.res_err(req, 404)
-		await req.sout.drain(); req.sout.close()
+		else:
+			if req.bs: req.keep = False
+			self.res_err(req, 404); k = None
+		self.res_end(req)
+		await req.sout.drain()
+		if k and self.stats: self.stats.td('http', k, req.ts)
 		req.log and req.log(f'Done [ {time.ticks_diff(time.ticks_ms(), req.ts):,d} ms]')
 
+	def req_srb(self, req):
+		# Returns SampleRingBuffer for tier= and v= (avg/min/max) query parameters
+		if not (tier := req.qs.get(b'tier')): return self.srb
+		for r in self.srb.rollups:
+			if r.name == tier.decode(): return r.srbs.get(req.qs.get(b'v', b'avg').decode())
+
 	async def req_page_index(self, req):
-		if not self.res_ok(req): return
+		# Page is only re-rendered when fan-clean action or sensor errors change
+		key = (next(self.act_fan_clean_iter) is not None, bytes(self.srb.buff_mv_err))
+		if key != self.page_key:
+			self.page_key, self.page_body = key, self.page_index_render(*key)
+			self.page_gen += 1
+		gz, cache = self.req_gzip(req), f'index.{self.srb.n_id}.{self.page_gen}'
+		if not self.res_ok(req, cache + '.gz' * gz, True): return
 		req.sout.write(b'Content-Type: text/html\r\n')
-		if sen_actions := next(self.act_fan_clean_iter):
+		self.res_body(req, gz, len(webui_head) + len(self.page_body))
+		req.sout.write(webui_head); req.sout.write(self.page_body)
+
+	def page_index_render(self, sen_actions, errs):
+		if sen_actions:
 			sen_actions = (
 				'\n<li><a href=\'{url}\'>Run fan cleaning</a> (at least every week)\n'
-				.format(url=req.url_links['act_fan_clean']) )
-		if err_msgs := self.srb.data_errors():
+				.format(url=self.req_url_links['act_fan_clean']) )
+		if err_msgs := self.srb.errs_parse(errs):
 			err_msgs = '\n'.join(
 				f'<li>{webui_err_msgs.get(err) or "Unknown error [{}]".format(err)}'
 				for err in err_msgs )
-		body = webui_body.strip().replace(b'\t', b'  ').format(
+		return webui_body.strip().replace('\t', '  ').format(
 			title=self.page_title,
 			sen_actions=sen_actions or '', err_msgs=err_msgs or '',
 			d3_api=self.d3_api, d3_from_cdn=int(self.d3_remote),
 			marks_bs_max=self.marks_bs_max,
-			**dict((f'url_{k}', url) for k, url in req.url_links.items()) )
-		page_bs = len(webui_head) + len(body)
-		req.sout.write(f'Content-Length: {page_bs}\r\n\r\n'.encode())
-		req.sout.write(webui_head); req.sout.write(body)
+			poll_interval=self.data_poll_td / 1000 if self.data_poll else 0,
+			data_max=self.srb.n_max,
+			**dict((f'url_{k}', url) for k, url in self.req_url_links.items()) ).encode()
 
 	def req_favicon(self, req): return self.res_static(req, 'favicon.ico')
 	def req_js(self, req): return self.res_static(req, 'webui.js')
@@ -699,8 +1601,8 @@ class WebUI:
 
 	async def req_data_marks(self, req):
 		if req.verb == b'get':
+			self.res_head(req, b'200 OK')
 			req.sout.write(
-				b'HTTP/1.0 200 OK\r\nServer: aqm\r\n'
 				b'Content-Type: application/octet-stream\r\n'
 				b'Cache-Control: no-cache\r\n'
 				b'X-Format: [ uint8 label-length || uint8 color'
@@ -716,74 +1618,274 @@ class WebUI:
 			if not self.marks:
 				self.marks, self.marks_bs = bytearray(self.marks_bs_max), 1
 				self.marks_mv = memoryview(self.marks)
-			if req.bs > len(self.marks_mv): return self.res_err(req, 413)
-			self.marks_bs = await req.sin.readinto(self.marks_mv[:req.bs])
+			if req.bs > len(self.marks_mv): req.keep = False; return self.res_err(req, 413)
+			self.marks_bs = await asyncio.wait_for(
+				req.sin.readinto(self.marks_mv[:req.bs]), self.read_timeout )
 			req.log and req.log(f'Marks: received {self.marks_bs:,d} / {req.bs:,d} B')
 			if self.marks_bs != req.bs:
-				self.marks[0], self.marks_bs = 0, 1
+				self.marks[0], self.marks_bs, req.keep = 0, 1, False
 				req.log and req.log('Marks: error - incomplete data read')
 				return self.res_err(req, 400)
-			req.sout.write(b'HTTP/1.0 204 No Content\r\nServer: aqm\r\n\r\n')
+			self.res_head(req, b'204 No Content'); req.sout.write(b'\r\n')
 		else: self.res_err(req, 405)
 
-	async def req_data_bin(self, req):
-		if not self.res_ok(req): return
+	def req_data_bin(self, req):
+		return self.res_data_bin(req, req.srb.data_samples_count(), cache=True)
+
+	def req_data_since(self, req):
+		return self.res_data_bin(req, req.srb.data_cursor_count(req.qs.get(b'c', b'')))
+
+	async def req_data_live(self, req):
+		# Server-Sent Events stream, with hex-encoded data_bin record for each new sample
+		# Event ids are cursors, to send missed samples after ?c=<cursor> or reconnect,
+		#   with "reload" event sent if there is no way to do that, e.g. after reboot.
+		if req.verb != b'get': return self.res_err(req, 405)
+		if self.live_n >= self.live_max: return self.res_err(req, 503)
+		if cursor := req.last_id or req.qs.get(b'c'): seq = req.srb.data_cursor_seq(cursor)
+		else: seq = req.srb.n_seq
+		self.buff_release(req) # not needed for long-lived stream
+		req.keep, srb = False, req.srb
+		self.res_ok(req); req.sout.write(b'Content-Type: text/event-stream\r\n\r\n')
+		self.live_n += 1
+		try:
+			while True:
+				if seq is None or (n := srb.n_seq - seq) > srb.data_samples_count():
+					req.log and req.log('Live: sending reload event')
+					req.sout.write(b'event: reload\ndata:\n\n'); await req.sout.drain(); break
+				if n:
+					samples = list()
+					for sample in srb.data_samples_raw():
+						if len(samples) == n: break
+						samples.append(sample)
+					for td, sample in reversed(samples):
+						seq += 1
+						req.sout.write( f'id: {srb.n_id:06x}.{seq}\ndata: '
+							f'{struct.pack(">d16s", td, sample).hex()}\n\n'.encode() )
+				try: await asyncio.wait_for(req.sout.drain(), self.live_timeout)
+				except asyncio.TimeoutError:
+					return req.log and req.log('Live: dropping slow client')
+				if srb.n_seq != seq: continue
+				srb.n_ev.clear()
+				try: await asyncio.wait_for(srb.n_ev.wait(), 30)
+				except asyncio.TimeoutError: req.sout.write(b': ping\n\n')
+		finally: self.live_n -= 1
+
+	async def req_data_agg(self, req):
+		# Query: n=<max-samples> f=<mean/min/max/lttb> k=<lttb-value-key>
+		try:
+			n, func = int(req.qs.get(b'n', 480)), req.qs.get(b'f', b'mean').decode()
+			if func == 'lttb':
+				count, samples = req.srb.data_samples_lttb(n, req.qs.get(b'k', b'pm25').decode())
+			else: count, samples = req.srb.data_samples_agg(n, func)
+		except (KeyError, ValueError): return self.res_err(req, 400)
+		await self.res_data_bin(req, count, samples)
+
+	async def req_data_range(self, req):
+		# Query: from=<seconds> to=<seconds> - time offsets into the past, to=0 by default
+		if rng := self.req_range_samples(req): await self.res_data_bin(req, rng[1], skip=rng[0])
+
+	async def req_data_range_csv(self, req):
+		if rng := self.req_range_samples(req): await self.res_data_csv(req, rng[1], skip=rng[0])
+
+	def req_range_samples(self, req):
+		# Returns (skip, count) for samples in from/to time range, seeking via skip_idx
+		try:
+			td = sorted( max(0, int(float(req.qs[k].decode()) * 1000))
+				if k in req.qs else v for k, v in [(b'from', 0xffffffffff), (b'to', 0)] )
+		except (ValueError, OverflowError): return self.res_err(req, 400)
+		skip, count = req.srb.data_range(*reversed(td))
+		req.log and req.log(f'Range: {td[0]/1000:,.1f}-{td[1]/1000:,.1f}s = {count:,d} samples')
+		return skip, count
+
+	def res_data_cache(self, req, k):
+		# ETag source for data exports, which only change with new samples/skips
+		return f'{k}.{req.srb.data_cursor()}.{req.srb.skip_last_pos}'
+
+	def res_data_age(self, req):
+		# Header with age of the latest sample, which time offsets in data are relative to
+		return f'X-Sample-Age: {req.srb.data_age()}\r\n'.encode()
+
+	async def res_data_bin(self, req, count, samples=None, cache=False, skip=0):
+		# Sends count of latest samples after skip, with X-Cursor for data_since requests
+		# Ranges are supported for cached full-data responses, skipping to first record.
+		if not (rng := self.res_ok( req, cache and self.res_data_cache(req, 'bin'), cache,
+			range_bs=count * 24 if cache else None, headers=self.res_data_age(req) )): return
+		a, b = (0, count * 24 - 1) if rng is True else rng
 		req.sout.write(
 			b'Content-Type: application/octet-stream\r\n'
 			b'X-Format: [ 8B double time-offset ms || 16B SEN5x sample ]*\r\n' )
-		buff, bs = self.buff_mv[:24], self.srb.data_samples_count() * 24
-		req.sout.write(f'Content-Length: {bs}\r\n\r\n'.encode())
-		for n, (td, sample) in enumerate(self.srb.data_samples_raw()):
-			struct.pack_into('>d16s', buff, 0, float(td), sample)
-			req.sout.write(buff)
-			if not n % 80: await req.sout.drain()
+		req.sout.write(( f'X-Cursor: {req.srb.data_cursor()}\r\n'
+			f'Content-Length: {b - a + 1}\r\n\r\n' ).encode())
+		n, pos = divmod(a, 24)
+		records, bs = ( req.srb.records_fill(samples, req.buff)
+			if samples else req.srb.data_records(req.buff, skip + n) ), 0
+		while a <= b:
+			for bs in records:
+				req.sout.write(req.buff[pos:min(bs, pos + b - a + 1)])
+				if (a := a + bs - pos) > b: break
+				await req.sout.drain(); pos = 0
+			else: records = req.srb.records_fill(self.res_data_pad( req,
+				(b - a) // 24 + 1, bs and struct.unpack_from('>d', req.buff, bs - 24)[0] ), req.buff)
+
+	async def req_data_cols(self, req):
+		# Query: from=<seconds> to=<seconds> - same as for data_range, all samples by default
+		if not (b'from' in req.qs or b'to' in req.qs):
+			return await self.res_data_cols( req,
+				req.srb.data_samples_count(), self.res_data_cache(req, 'cols') )
+		if rng := self.req_range_samples(req): await self.res_data_cols(req, rng[1], skip=rng[0])
+
+	async def res_data_cols(self, req, count, cache=None, skip=0):
+		# Sends header with time-offset segments, and samples in blocks of value columns
+		# Segments are computed from skip_idx, and samples are iterated-over only once,
+		#   with skip adjusted for ones added while header is sent, and padded as usual.
+		if not self.res_ok(req, cache, bool(cache), headers=self.res_data_age(req)): return
+		srb, buff, hfmt = req.srb, req.buff, '>4sHIHH8s8H'
+		segs, seq, k = srb.data_segments(count, skip), srb.n_seq, len(buff) // srb.sbs
+		req.sout.write(
+			b'Content-Type: application/octet-stream\r\n'
+			b'X-Format: v2 [ header || time-offset segments || int16 value-column blocks ]\r\n' )
+		bs = struct.calcsize(hfmt) + len(segs) * 16 + count * srb.sbs
+		req.sout.write(( f'X-Cursor: {srb.data_cursor()}\r\n'
+			f'Content-Length: {bs}\r\n\r\n' ).encode())
+		struct.pack_into( hfmt, buff, 0, self.cols_magic, 2,
+			count, k, len(segs), srb.s_fmt[1:].encode(), *srb.s_ks )
+		n = struct.calcsize(hfmt)
+		for seg in segs:
+			if n + 16 > len(buff): req.sout.write(buff[:n]); await req.sout.drain(); n = 0
+			struct.pack_into('>IId', buff, n, *seg); n += 16
+		req.sout.write(buff[:n])
+		samples = srb.data_samples_raw(skip + srb.n_seq - seq)
+		for m in range(0, count, k):
+			bs = min(k, count - m) * 2 # column size in this block
+			for p in range(0, bs, 2):
+				if not (sample := next(samples, None)): # overwritten during transfer
+					sample = next(samples := self.res_data_pad(req, count - m - p // 2, 0))
+				sample = sample[1]
+				for c in range(0, 16, 2):
+					n = (c >> 1) * bs + p; buff[n], buff[n+1] = sample[c], sample[c+1]
+			req.sout.write(buff[:bs*8]); await req.sout.drain()
+
+	def res_data_pad(self, req, count, td):
+		# Yields samples with missing values after td, to send instead of count oldest ones,
+		#   which were overwritten in ring buffer while response was being sent.
+		req.log and req.log(f'Data: {count:,d} sample(s) overwritten during transfer')
+		sample = struct.pack(req.srb.s_fmt, *req.srb.s_nx)
+		for n in range(count): td += req.srb.n_td; yield (td, sample)
 
 	async def req_data_raw(self, req):
-		if not self.res_ok(req): return
+		# Buffer is sent as-is in chunks, so can be inconsistent if samples are added meanwhile
+		cache = self.res_data_cache(req, f'raw.{bytes(req.srb.buff_mv_err).hex()}')
+		buff, bs = req.srb.buff_mv, len(req.buff)
+		if not (rng := self.res_ok(req, cache, True, range_bs=len(buff))): return
+		n, end = (0, len(buff)) if rng is True else (rng[0], rng[1] + 1)
 		req.sout.write(
 			b'Content-Type: application/octet-stream\r\n'
 			b'X-Format: Raw SampleRingBuffer contents for debugging\r\n' )
-		n, buff_bs, bs = 0, len(buff := self.srb.buff_mv), len(self.buff)
-		req.sout.write(f'Content-Length: {buff_bs}\r\n\r\n'.encode())
-		while n < buff_bs:
-			req.sout.write(buff[n:n+bs])
+		req.sout.write(f'Content-Length: {end - n}\r\n\r\n'.encode())
+		while n < end:
+			req.sout.write(buff[n:min(end, n+bs)])
 			await req.sout.drain()
 			n += bs
 
-	async def req_data_csv(self, req):
-		if not self.res_ok(req): return
+	def req_data_csv(self, req):
+		return self.res_data_csv(req, req.srb.data_samples_count(), self.res_data_cache(req, 'csv'))
+
+	async def res_data_csv(self, req, count, cache=None, skip=0):
+		gz = self.req_gzip(req, sized=False)
+		if not self.res_ok( req, cache and cache + '.gz' * gz,
+			bool(cache), headers=self.res_data_age(req) ): return
 		req.sout.write(b'Content-Type: text/csv\r\n')
-		header = b'time_offset, pm10, pm25, pm40, pm100, rh, t, voc, nox\n'
-		line_base = ( b' 123456.0, 123.0, 123.0,'
-			b' 123.0, 123.0, 12.34, 12.345, 1234.0, 1234.0\n' )
-		(line := self.buff_mv[:len(line_base)])[:] = line_base
-		bs = len(header) + self.srb.data_samples_count() * len(line)
-		req.sout.write(f'Content-Length: {bs}\r\n\r\n'.encode())
-		req.sout.write(header)
-		# for f in line.rstrip().split(b','): fields.append((n, m:=len(f))); n+=m+1
-		fields = (0,9),(10,6),(17,6),(24,6),(31,6),(38,6),(45,7),(53,7),(61,7)
-		fmt = dict((vlen, f'{{:>{vlen}}}') for pos,vlen in fields)
-		for n, (ts, sample) in enumerate(self.srb.data_samples()):
-			vals = (abs(ts),) + sample
-			for v, (pos, vlen) in zip(vals, fields):
-				if v is None: vs = b''
-				else:
-					vs = str(float(v))[:vlen]
-					if '.' not in vs:
-						k = header.decode().split(',')[vals.index(v)]
-						raise ValueError( 'Sensor value too long'
-							+ f' for CSV field [{k.strip()}:{vlen}]: {v}' )
-					vs = vs.rstrip('.').encode()
-				line[pos:pos+vlen] = fmt[vlen].format(vs).encode()
-			req.sout.write(line)
-			if not n % 20: await req.sout.drain()
+		self.res_body(req, gz)
+		req.sout.write(b'time_offset,pm10,pm25,pm40,pm100,rh,t,voc,nox\n')
+		# Lines are encoded from raw sample integers into buffer, and sent in batches
+		# Decimal points are per-value, with t value scaled by 5 for /1000 instead of /200
+		dps, buff, fmt, nx = (1, 1, 1, 1, 2, 3, 1, 1), req.buff, req.srb.s_fmt, req.srb.s_nx
+		end = len(buff) - 100 # any line is <100B
+		pos, td, samples = 0, 0, req.srb.data_samples_raw(skip)
+		while count > 0:
+			for td, sample in samples:
+				pos = self.csv_value(buff, pos, td, 3)
+				for c, v in enumerate(struct.unpack(fmt, sample)):
+					buff[pos] = 44; pos += 1 # ,
+					if v != nx[c]: pos = self.csv_value(buff, pos, v * 5 if c == 5 else v, dps[c])
+				buff[pos] = 10; pos += 1 # \n
+				if pos > end: req.sout.write(buff[:pos]); await req.sout.drain(); pos = 0
+				if not (count := count - 1): break
+			else: samples = self.res_data_pad(req, count, td)
+		if pos: req.sout.write(buff[:pos])
+
+	@staticmethod
+	def csv_value(buff, pos, v, dp):
+		# Writes v / 10^dp integer as decimal into buff at pos, returning end position
+		# Trailing zeroes are dropped, except one after decimal point, same as str(float) outputs.
+		if v < 0: v = -v; buff[pos] = 45; pos += 1 # -
+		while dp > 1 and not v % 10: v //= 10; dp -= 1
+		iv, n = v // (1, 10, 100, 1000)[dp], 1
+		while iv >= 10: iv //= 10; n += 1
+		p = pos = pos + n + (dp and dp + 1)
+		for c in range(dp): p -= 1; buff[p] = 48 + v % 10; v //= 10
+		if dp: p -= 1; buff[p] = 46 # .
+		while True:
+			p -= 1; buff[p] = 48 + v % 10
+			if not (v := v // 10): break
+		return pos
+
+	async def req_metrics(self, req):
+		# Prometheus text-format metrics, re-rendered into buffer only after new samples
+		# Uptime value is last, and its zero-padded digits are updated in-place here.
+		key = self.srb.n_seq, bytes(self.srb.buff_mv_err), sum(self.rejects.values())
+		if key != self.metrics_key:
+			self.metrics_key = key; self.metrics_render(self.srb)
+		gz = self.req_gzip(req)
+		if not self.res_ok(req): return
+		buff, (pos, end), v = self.metrics, self.metrics_uptime, int(time.time() - self.ts_start)
+		while end > pos: end -= 1; buff[end] = 48 + v % 10; v //= 10
+		req.sout.write(b'Content-Type: text/plain; version=0.0.4\r\n')
+		self.res_body(req, gz, self.metrics_bs)
+		req.sout.write(self.metrics_mv[:self.metrics_bs])
+
+	def metrics_render(self, srb):
+		td, sample = next(srb.data_samples_raw(), (0, None))
+		sample, lines = sample and srb.s_parse(sample) or [None] * 8, list()
+		for k, t, desc, vals in (
+				('pm_ugm3', 'gauge', 'Particulate matter concentration, ug/m3', list(
+					(f'{{size="{sz}"}}', v) for sz, v in zip(['1.0', '2.5', '4.0', '10'], sample) )),
+				('humidity_percent', 'gauge', 'Relative humidity', [('', sample[4])]),
+				('temperature_celsius', 'gauge', 'Temperature', [('', sample[5])]),
+				('voc_index', 'gauge', 'VOC index (1-500)', [('', sample[6])]),
+				('nox_index', 'gauge', 'NOx index (1-500)', [('', sample[7])]),
+				('sensor_error', 'gauge', 'Active SEN5x warning/error flags',
+					list((f'{{flag="{err}"}}', 1) for err in srb.data_errors())),
+				('samples', 'gauge', 'Samples stored in memory', [('', srb.data_samples_count())]),
+				('samples_total', 'counter', 'Samples collected', [('', srb.n_seq)]),
+				('sample_skips', 'gauge', 'Time-skip blocks in memory', [('', srb.n_skips)]),
+				('http_rejects_total', 'counter', 'HTTP requests rejected or dropped', list(
+					(f'{{reason="{k}"}}', v) for k, v in sorted(self.rejects.items()) )),
+				('uptime_seconds', 'counter', 'Time since start', [('', 0)]) ):
+			lines.append(f'# HELP aqm_{k} {desc}\n# TYPE aqm_{k} {t}')
+			for labels, v in vals:
+				if v is not None: lines.append(f'aqm_{k}{labels} {v}')
+		body = ('\n'.join(lines)[:-1] + '0' * 10 + '\n').encode()
+		if not self.metrics or len(self.metrics) < len(body):
+			self.metrics = bytearray(len(body) + 256); self.metrics_mv = memoryview(self.metrics)
+		self.metrics_bs = len(body); self.metrics_mv[:self.metrics_bs] = body
+		self.metrics_uptime = self.metrics_bs - 11, self.metrics_bs - 1
+
+	async def req_debug_stats(self, req):
+		gz = self.req_gzip(req)
+		if not self.res_ok(req): return
+		body = self.stats.json().encode()
+		req.sout.write(b'Content-Type: application/json\r\n')
+		self.res_body(req, gz, len(body))
+		req.sout.write(body)
 
 	async def req_act_fan_clean(self, req):
 		if req.verb != b'get': return self.res_err(req, 405)
 		if not (fan_clean_func := next(self.act_fan_clean_iter)): return self.res_err(req, 429)
 		await fan_clean_func()
-		req.sout.write(b'HTTP/1.0 302 Found\r\nServer: aqm\r\n')
-		req.sout.write(f'Location: {req.url_links["page_index"] or "/"}\r\n\r\n'.encode())
+		self.res_head(req, b'302 Found')
+		req.sout.write(( f'Location: {req.url_links["page_index"] or "/"}\r\n'
+			'Content-Length: 0\r\n\r\n' ).encode())
 
 
 class UDPAlerts:
@@ -895,9 +1997,42 @@ async def main_aqm(conf, wifi):
 	if conf.sensor_sample_count >= 2**16: # 1 MiB ought to be enough for everybody
 		return p_err('Sample count values >65536 are not supported')
 	conf.sensor_sample_interval = int(conf.sensor_sample_interval * 1000)
-	srb = SampleRingBuffer(
+	rollups = list()
+	for spec in conf.sensor_sample_rollups.split():
+		try:
+			name, _, count = spec.partition(':')
+			td = int(float(name[:-1]) * {'s': 1, 'm': 60, 'h': 3600, 'd': 24*3600}[name[-1]] * 1000)
+			if not 0 < (count := int(count)) < 2**16 or td <= conf.sensor_sample_interval:
+				raise ValueError('count or interval out of range')
+		except (KeyError, ValueError) as err:
+			return p_err(f'Invalid sample-rollups spec [ {spec} ]: {err_fmt(err)}')
+		rollups.append((name, td, count))
+	if n := 3 * sum(count for name, td, count in rollups): # avg/min/max from same budget
+		if (count := conf.sensor_sample_count - n) < 2:
+			return p_err( f'sample-rollups need {n:,d} samples, leaving'
+				f' {count:,d} of sample-count={conf.sensor_sample_count:,d} for regular ones' )
+		conf.sensor_sample_count = count
+	srb = (SampleRingBufferPacked if conf.sensor_sample_packed else SampleRingBuffer)(
 		conf.sensor_sample_interval, conf.sensor_sample_count )
+	for name, td, count in rollups: srb.rollups.append(SampleRollup(name, td, count, srb.lock))
+	if adaptive := conf.sensor_sample_adaptive:
+		td = int(conf.sensor_sample_adaptive_interval * 1000)
+		if not 1000 <= td < conf.sensor_sample_interval:
+			return p_err('sample-adaptive-interval must be >=1s and lower than sample-interval')
+		adaptive = SampleAdaptive(
+			conf.sensor_sample_interval, td, int(conf.sensor_sample_adaptive_hold * 1000),
+			conf.sensor_sample_adaptive_pm_delta, conf.sensor_sample_adaptive_voc_delta )
+	if conf.sensor_sample_log:
+		slog = SampleLog( conf.sensor_sample_log, conf.sensor_sample_log_batch,
+			conf.sensor_sample_log_segment_kb * 1024, conf.sensor_sample_log_segments,
+			verbose=conf.sensor_verbose )
+		slog.restore( srb, conf.sensor_sample_count * (4 if conf.sensor_sample_packed else 1),
+			adaptive and (adaptive.td_slow, adaptive.td_fast) )
+		srb.sample_td_set(conf.sensor_sample_interval) # poller starts with it
+		srb.log = slog
 	alerts = UDPAlerts.create_if_needed(conf)
+	if stats := conf.debug_stats and Stats( int(conf.debug_stats_loop_interval * 1000),
+		int(conf.debug_stats_mem_interval * 1000) ): components.append(stats.monitor())
 
 	i2c = dict()
 	if conf.sensor_i2c_freq: i2c['freq'] = conf.sensor_i2c_freq
@@ -908,7 +2043,7 @@ async def main_aqm(conf, wifi):
 		sda=machine.Pin(conf.sensor_i2c_pin_sda),
 		scl=machine.Pin(conf.sensor_i2c_pin_scl), **i2c )
 
-	sen5x = Sen5x(i2c, conf.sensor_i2c_addr)
+	sen5x = Sen5x(i2c, conf.sensor_i2c_addr, stats=stats)
 	if conf.sensor_reset_on_start: await sen5x('reset')
 	if ( conf.sensor_temp_comp_offset
 			or conf.sensor_temp_comp_slope
@@ -922,7 +2057,7 @@ async def main_aqm(conf, wifi):
 		td_errs=int(conf.sensor_error_check_interval * 1000),
 		err_rate_limit=token_bucket_iter(conf.sensor_i2c_error_limit),
 		stop_on_exit=conf.sensor_stop_on_exit,
-		alerts=alerts, verbose=conf.sensor_verbose ))
+		alerts=alerts, adaptive=adaptive, verbose=conf.sensor_verbose ))
 	webui_opts['fan_clean_func_iter'] = \
 		sen5x.fan_clean_func_iter(int(conf.sensor_fan_clean_min_interval * 1000))
 
@@ -930,7 +2065,19 @@ async def main_aqm(conf, wifi):
 		webui = WebUI( srb, page_title=conf.webui_title,
 			url_prefix=conf.webui_url_prefix, verbose=conf.webui_verbose,
 			d3_api=conf.webui_d3_api, d3_remote=conf.webui_d3_load_from_internet,
-			marks_bs_max=conf.webui_marks_storage_bytes, **webui_opts )
+			marks_bs_max=conf.webui_marks_storage_bytes,
+			data_poll=conf.webui_data_poll, data_poll_td=conf.sensor_sample_interval,
+			graph_points=conf.webui_graph_points,
+			data_live_clients=conf.webui_data_live_clients,
+			data_live_timeout=conf.webui_data_live_timeout,
+			graph_points_func=conf.webui_graph_points_func,
+			buffers=conf.webui_buffers, buffer_size=conf.webui_buffer_size,
+			buffer_wait=conf.webui_buffer_wait, conn_requests=conf.webui_conn_requests,
+			gzip_window_bits=conf.webui_gzip_window_bits,
+			conn_idle_timeout=conf.webui_conn_idle_timeout,
+			conn_per_peer=conf.webui_conn_per_peer, header_max_bytes=conf.webui_header_max_bytes,
+			read_timeout=conf.webui_read_timeout, write_timeout=conf.webui_write_timeout,
+			stats=stats, **webui_opts )
 	else: p_err('Socket API not supported in micropython firmware, not starting WebUI')
 
 	print('--- AQM start ---')
@@ -942,6 +2089,7 @@ async def main_aqm(conf, wifi):
 		await asyncio.gather(*components)
 	finally:
 		if httpd: httpd.close(); await httpd.wait_closed() # to reuse socket for err-msg
+		if srb.log: srb.log.flush()
 		print('--- AQM stop ---')
 
 async def main_fail_webui_req(fail, fail_ts, sin, sout, _html=(
@@ -968,7 +2116,7 @@ async def main_fail_webui_req(fail, fail_ts, sin, sout, _html=(
 			document.getElementById('tail').innerHTML =
 				`<p>Error date/time: ${dt} [${tz}]</p><a href=reset.%fid>Reset Device</a>`
 			</script>'''.replace(b'\t', b' ').replace(b'%fid', fid).replace(b'%td', td)
-		sout.write(f'Content-Length: {len(_html) + len(fail) + len(tail)}\r\n\r\n')
+		sout.write(f'Content-Length: {len(_html) + len(fail) + len(tail)}\r\n\r\n'.encode())
 		sout.write(_html); sout.write(fail); sout.write(tail)
 		await sout.drain()
 	finally:
@@ -33,8 +33,9 @@ if (!d3) return document.getElementById('graph').innerHTML = `
 
 // Shared helpers
 
-let fetch_data = req => fetch(req).then(async res => {
+let fetch_data = (req, res_hook) => fetch(req).then(async res => {
 		if (!res.ok) throw `HTTP Error [ ${req.url || req} ]: ${res.status} ${res.statusText}`
+		if (res_hook) res_hook(res)
 		return new DataView(await res.arrayBuffer()) })
 	.catch(err => {
 		console.log(`Fetch ERROR: ${err}`)
@@ -72,27 +73,73 @@ else {
 	ts_now_label = `, ${fmt_ts_iso8601(ts_now, true)} now` }
 
 
-let data, dss, ds_map, ds_text,
+let data, data_cursor, data_decode, data_parse, data_row, dss, ds_map, ds_text,
 	ds_pmx = ['pm10', 'pm25', 'pm40', 'pm100'], ds_aux = ['voc', 'nox', 't', 'rh']
 Data: {
-	let fetch_samples = async ts => {
+	// Data is a set of columns - {ts: Float64Array, pm10: Float32Array, ...} in time order
+	// data_decode must be self-contained, as it's also used as a Web Worker source code
+	data_decode = (data_raw, ts) => {
+		let keys = ['pm10', 'pm25', 'pm40', 'pm100', 'rh', 't', 'voc', 'nox'],
+			v2 = data_raw.byteLength >= 38 && data_raw.getUint32(0) === 0xffff4151, // NaN time + AQ
+			count = v2 ? data_raw.getUint32(6) : Math.floor(data_raw.byteLength / 24),
+			cols = {ts: new Float64Array(count)}
+		keys.forEach(key => cols[key] = new Float32Array(count))
+		if (v2) {
+			// v2 format: header || time-offset segments || blocks of int16 value columns
+			// Header: magic, version, sample count, block size, segments, value types, divisors
+			let k = data_raw.getUint16(10), segs = data_raw.getUint16(12), n = 38 + segs * 16
+			for (let m = 0; m < segs; m++) { // segment = [first sample, td step, first td]
+				let p = 38 + m*16, i0 = data_raw.getUint32(p),
+					i_end = m < segs - 1 ? Math.min(count, data_raw.getUint32(p + 16)) : count,
+					td_step = data_raw.getUint32(p + 4), td = ts - data_raw.getFloat64(p + 8)
+				for (let i = i0; i < i_end; i++) cols.ts[count - 1 - i] = td - (i - i0) * td_step }
+			keys.forEach((key, c) => {
+				let col = cols[key], signed = data_raw.getUint8(14 + c) === 0x68, // h
+					nx = signed ? 0x7fff : 0xffff, div = data_raw.getUint16(22 + c*2)
+				for (let m = 0, p = n; m < count; m += k) {
+					let bs = Math.min(k, count - m) * 2
+					for (let i = count - 1 - m, pe = p + c*bs + bs, pc = p + c*bs; pc < pe; pc += 2, i--) {
+						let d = signed ? data_raw.getInt16(pc) : data_raw.getUint16(pc)
+						col[i] = d === nx ? NaN : d / div }
+					p += bs * 8 } }) }
+		else { // v1 format: fixed-size latest-first records
+			let ks = [10, 10, 10, 10, 100, 200, 10, 10]
+			for (let i = 0, p = 0; i < count; i++, p += 24) {
+				let n = count - 1 - i
+				cols.ts[n] = ts - data_raw.getFloat64(p)
+				for (let c = 0; c < 8; c++) {
+					let d = c < 4 ? data_raw.getUint16(p + 8 + c*2) : data_raw.getInt16(p + 8 + c*2)
+					cols[keys[c]][n] = d === (c < 4 ? 0xffff : 0x7fff) ? NaN : d / ks[c] } } }
+		for (let i = 1; i < count; i++) if (cols.ts[i] < cols.ts[i-1]) { // not expected to happen
+			let idx = Uint32Array.from(cols.ts.keys()).sort((a, b) => cols.ts[a] - cols.ts[b])
+			for (let key in cols) cols[key] = cols[key].map((_, n) => cols[key][idx[n]])
+			break }
+		return cols }
+
+	let worker
+	data_parse = (data_raw, ts) => new Promise(resolve => {
+		// Decodes data in a Web Worker, or here if that fails, e.g. with CSP on snapshot pages
+		let decode = () => { worker = false; resolve(data_decode(data_raw, ts)) }
 		if (!ts) ts = ts_now
-		let sbs = 24,
-			sample_keys = ['ts', 'pm10', 'pm25', 'pm40', 'pm100', 'rh', 't', 'voc', 'nox'],
-			sample_ks = [1, 10, 10, 10, 10, 100, 200, 10, 10],
-			sample_nx = [-1, 0xffff, 0xffff, 0xffff, 0xffff, 0x7fff, 0x7fff, 0x7fff, 0x7fff],
-			data_raw = opts.data || await fetch_data(urls.data)
-		return d3.range(0, data_raw.byteLength, sbs).map(n => {
-			let vals = [data_raw.getFloat64(n)]
-			vals.push.apply(vals, d3.range(n=n+8, n=n+2*4, 2).map(n => data_raw.getUint16(n)))
-			vals.push.apply(vals, d3.range(n, n+2*4, 2).map(n => data_raw.getInt16(n)))
-			vals = Object.fromEntries(
-				d3.zip(sample_keys, vals, sample_ks, sample_nx)
-					.map(([key, d, k, nx]) => [key, d === nx ? null : d / k]) )
-			vals.ts = ts - vals.ts
-			return vals }).sort((d1, d2) => d1.ts - d2.ts) }
-
-	data = await fetch_samples()
+		if (!data_raw) data_raw = new DataView(new ArrayBuffer(0))
+		if (worker === false || !window.Worker) return decode()
+		try {
+			worker = worker || new Worker(URL.createObjectURL(new Blob([ 'onmessage = ev => {'
+				+ ` let cols = (${data_decode})(ev.data.data_raw, ev.data.ts);`
+				+ ' postMessage(cols, Object.values(cols).map(col => col.buffer)) }' ])))
+			worker.onmessage = ev => resolve(ev.data)
+			worker.onerror = ev => { ev.preventDefault(); decode() }
+			worker.postMessage({data_raw: data_raw, ts: ts}) }
+		catch (err) { decode() } })
+
+	data_row = n => Object.fromEntries( // sample object from columns, with null for NaN values
+		Object.entries(data).map(([k, col]) => [k, isNaN(col[n]) ? null : col[n]]) )
+
+	// Time offsets in data are from the latest sample, with its age in X-Sample-Age header
+	let ts_data = ts_now, data_raw = opts.data || await fetch_data(urls.data, res => {
+		data_cursor = res.headers.get('X-Cursor')
+		ts_data -= res.headers.get('X-Sample-Age') || 0 })
+	data = await data_parse(data_raw, ts_data)
 	dss = d3.zip( ds_pmx,
 			['PM1', 'PM2.5', 'PM4', 'PM10'],
 			['#fdc28c', '#fc9346', '#eb6311', '#bb3d02'],
@@ -103,7 +150,7 @@ Data: {
 	d3.zip( ds_aux, ['VOC', 'NOx', 'T°C', 'RH%'],
 			['#54e01150', '#41a6a280', '#d175c180', '#b31b7ce0'], [null, null, '5,5', '5,5'] )
 		.forEach(([k, label, c, ld]) => dss.push({k: k, label: label, color: c, line_dash: ld}))
-	dss = dss.filter(ds => data.some(d => d[ds.k] !== null)) // unsupported values
+	dss = dss.filter(ds => data[ds.k].some(v => !isNaN(v))) // unsupported values
 
 	ds_map = Object.fromEntries(dss.map(ds => [ds.k, ds]))
 	ds_map['ts'] = {k: 'ts', fmt: fmt_ts_iso8601}
@@ -118,21 +165,37 @@ Data: {
 
 let margin = {top: 20, right: 130, bottom: 50, left: 70},
 	sz = {w: 960 - margin.left - margin.right, h: 700 - margin.top - margin.bottom},
-	x = d3.scaleTime().range([0, sz.w]).domain(d3.extent(data, d => d.ts)),
-	y_pmx_ext = (() => { // find y extent to exclude any off-the-charts outliers
-		let pmx = d3.sort(ds_pmx.map(k => data.map(d => d[k])).flat()),
-			ext_q = q => pmx[Math.min(pmx.length-1, parseInt(pmx.length * q) + 1)],
-			ext = pmx[pmx.length-1], ext_max = ext_q(0.95) / 0.5 // low-95% go up to 50%+
-		if (pmx.length > 10 && ext > ext_max)
+	x = d3.scaleTime().range([0, sz.w]),
+	y_pmx_ext = () => { // find y extent to exclude any off-the-charts outliers
+		// Quantiles are picked via quickselect, each within range between already-picked ones
+		let pmx = new Float32Array(ds_pmx.length * data.ts.length), n = 0, ks = []
+		ds_pmx.forEach(k => data[k].forEach(v => { if (!isNaN(v)) pmx[n++] = v }))
+		let ext_q = q => {
+				let k = Math.min(n-1, parseInt(n * q) + 1), a = 0, b = n - 1
+				ks.forEach(kx => { if (kx < k) a = Math.max(a, kx + 1); if (kx > k) b = Math.min(b, kx - 1) })
+				if (!ks.includes(k)) { d3.quickselect(pmx, k, a, b); ks.push(k) }
+				return pmx[k] },
+			ext = d3.max(pmx.subarray(0, n)), ext_max = ext_q(0.95) / 0.5 // low-95% go up to 50%+
+		if (n > 10 && ext > ext_max)
 			[0.999, 0.998, 0.997, 0.995, 0.992, 0.99, 0.98, 0.965, 0.95]
 				.some(q => { if ((q = ext_q(q)) <= ext_max) { ext = q; return true } })
-		return ext })(),
-	y_pmx = d3.scaleLinear().range([sz.h, 0]).domain([0, y_pmx_ext]),
-	ys = Object.fromEntries(
-		dss.map(ds => [ ds.k, ds_pmx.includes(ds.k) ? y_pmx :
-			d3.scaleLinear().range([sz.h, 0]).domain(d3.extent(data.map(d => d[ds.k]))) ]) ),
+		return ext },
+	y_pmx = d3.scaleLinear().range([sz.h, 0]),
+	ys = Object.fromEntries( dss.map(ds =>
+		[ds.k, ds_pmx.includes(ds.k) ? y_pmx : d3.scaleLinear().range([sz.h, 0])] ) ),
+	ys_update = () => {
+		x.domain(d3.extent(data.ts))
+		y_pmx.domain([0, y_pmx_ext()])
+		ds_aux.forEach(k => ys[k].domain(d3.extent(data[k]))) },
+	ys_line = k => d3.line() // lines are drawn from data.ts column, with same index in others
+		.defined((ts, n) => !isNaN(data[k][n])).x(ts => x(ts)).y((ts, n) => ys[k](data[k][n])),
 	ax = () => d3.axisBottom(x).ticks(8),
-	ay_pmx = () => d3.axisLeft(y_pmx) // main Y axis
+	ay_pmx = () => d3.axisLeft(y_pmx), // main Y axis
+	ay_aux = k => s => s.call(d3.axisRight(ys[k]))
+		.call(s => s.selectAll('.tick text')
+			.style('text-anchor', 'middle')
+			.attr('transform', 'rotate(60) translate(-3 -13)'))
+ys_update()
 
 let vis = d3.select('#graph svg')
 		.attr('width', sz.w + margin.left + margin.right)
@@ -145,7 +208,7 @@ let vis = d3.select('#graph svg')
 			ay_pmx().tickSize(-sz.w, 0).tickFormat('') ) })
 	.call(s => s
 		.append('g')
-			.attr('class', 'x axis fg').attr('transform', `translate(0 ${sz.h})`)
+			.attr('class', 'x axis main fg').attr('transform', `translate(0 ${sz.h})`)
 			.call(ax())
 		.append('text')
 			.attr('transform', `translate(${sz.w} 0)`)
@@ -153,24 +216,31 @@ let vis = d3.select('#graph svg')
 			.style('text-anchor', 'end').text(
 				`Date/time in local/browser timezone (${fmt_ts_tz}${ts_now_label})` ) )
 	.call(s => s
-		.append('g').attr('class', 'y axis fg').datum(ds_pmx).call(ay_pmx())
+		.append('g').attr('class', 'y axis main fg').datum(ds_pmx).call(ay_pmx())
 		.append('text')
 			.attr('transform', 'rotate(-90)').attr('dx', '-1em').attr('dy', '-3em')
 			.style('text-anchor', 'end').text('PMx µg/m³') )
 	.call(s => ds_aux.forEach((k, n) =>
-		s.append('g').attr('class', 'y axis fg').datum(k)
+		s.append('g').attr('class', 'y axis aux fg').datum(k)
 			.attr('transform', `translate(${sz.w + n*30} 0)`)
-			.call(d3.axisRight(ys[k]))
-			.call(s => s.selectAll('text')
-				.style('text-anchor', 'middle')
-				.attr('transform', 'rotate(60) translate(-3 -13)'))
+			.call(ay_aux(k))
 			.append('text')
 				.attr('transform', 'rotate(-90)').attr('dx', -(sz.h+10)).attr('dy', '1.5em')
 				.style('text-anchor', 'end').text(ds_map[k].label)) )
 	.call(s => dss.forEach(ds => ds.line = s.append('path')
-		.data([data]).attr('class', `line ${ds.k}`).attr('stroke', ds.color || 'currentColor')
+		.attr('class', `line ${ds.k}`).attr('stroke', ds.color || 'currentColor')
 		.attr('stroke-width', ds.line_w || null).attr('stroke-dasharray', ds.line_dash || null)
-		.attr('d', d3.line().x(d => x(d.ts)).y(d => ys[ds.k](d[ds.k]))) ))
+		.attr('d', ys_line(ds.k)(data.ts)) ))
+
+let chart_hooks = [], chart_update = () => { // redraw for updated data
+	ys_update()
+	vis.select('.x.grid').call(ax().tickSize(sz.h, 0).tickFormat(''))
+	vis.select('.y.grid').call(ay_pmx().tickSize(-sz.w, 0).tickFormat(''))
+	vis.select('.x.axis.main').call(ax())
+	vis.select('.y.axis.main').call(ay_pmx())
+	vis.selectAll('.y.axis.aux').each((k, n, ns) => d3.select(ns[n]).call(ay_aux(k)))
+	dss.forEach(ds => ds.line.attr('d', ys_line(ds.k)(data.ts)))
+	chart_hooks.forEach(func => func()) }
 
 
 let mark_add_ts = ts => null
@@ -272,12 +342,12 @@ Marks: {
 		mta_commit(); mta_update() },
 
 	mta_update()
+	chart_hooks.push(mvis_update)
 } // Marks
 
 
 Focus: {
 	let side = -1, // 1 or -1
-		x_bisect = d3.bisector(d => d.ts).left,
 		y_axes = vis.selectAll('.y.axis'),
 		focus = vis
 			.append('g').attr('class', 'focus').style('display', 'none')
@@ -287,9 +357,12 @@ Focus: {
 			.attr('x', 10).attr('dy', '.3em')
 			.attr('text-anchor', side > 0 ? 'start' : 'end')
 
-	let del_p,
-		del_ps = data.map(d => dss.map(ds => [x(d.ts), ys[ds.k](d[ds.k]), ds])).flat(),
-		del = d3.Delaunay.from(del_ps)
+	let del_p, del_ps, del, del_update = () => {
+		del_ps = []
+		data.ts.forEach((ts, n) => dss.forEach(ds => isNaN(data[ds.k][n]) ||
+			del_ps.push([x(ts), ys[ds.k](data[ds.k][n]), ds]) ))
+		del = d3.Delaunay.from(del_ps); del_p = undefined }
+	del_update(); chart_hooks.push(del_update)
 	// vis.append('g').selectAll('path').data(del.voronoi([0, 0, sz.w, sz.h]).cellPolygons())
 	// 	.join( en => en.append('path').attr('stroke', 'red')
 	// 		.attr('fill', 'none'), upd => upd, ex => ex.remove() )
@@ -300,11 +373,11 @@ Focus: {
 			return `${label ? (label+': ') : ''}${(ds_map[k]?.fmt || fmt_n)(d[k])}` }
 
 	let focus_call = func => (ev, d) => { // calls func(d, ds)
-		if (data.length < 2) return
-		let [px, py] = d3.pointer(ev),
-			x0 = x.invert(px), n = x_bisect(data, x0, 1)
-		if (x0 - data[n-1].ts <= data[n] - x0) n -= 1
-		func(data[n], del_ps[del_p = del.find(px, py, del_p)][2]) }
+		if (data.ts.length < 2) return
+		let [px, py] = d3.pointer(ev), x0 = +x.invert(px),
+			n = Math.min(data.ts.length - 1, d3.bisectLeft(data.ts, x0, 1))
+		if (x0 - data.ts[n-1] <= data.ts[n] - x0) n -= 1
+		func(data_row(n), del_ps[del_p = del.find(px, py, del_p)]?.[2]) }
 
 	let focus_hl_line = hl_set => {
 		let hs_ds = hl_set || ((k, a, b) => b), hs_ax = hl_set || (() => true)
@@ -334,4 +407,45 @@ Focus: {
 				.text(k => fmt_line(d, k)).classed('hl', k => hl_set(k)) ) }))
 } // Focus
 
+
+Poll: { // fetch/add new samples, if enabled
+	if (!opts.poll_interval || !urls.data_since || opts.data || !data_cursor) break Poll
+	// Appends new samples to the end of data columns, dropping oldest ones beyond data_max,
+	//  which is either device sample-count or the number of samples from initial data load
+	let data_max = Math.max(data.ts.length, opts.data_max || 0), data_add = cols => {
+		let n = data.ts.length, m = n ? d3.bisectRight(cols.ts, data.ts[n-1]) : 0
+		if (m >= cols.ts.length) return
+		let n_new = n + cols.ts.length - m, trim = Math.max(0, n_new - data_max)
+		for (let k in data) {
+			let col = new data[k].constructor(n_new)
+			col.set(data[k]); col.set(cols[k].subarray(m), n)
+			data[k] = trim ? col.subarray(trim) : col }
+		chart_update() }
+	let poll = () => fetch(`${urls.data_since}?c=${data_cursor}`).then(async res => {
+			if (!res.ok) throw `HTTP Error: ${res.status} ${res.statusText}`
+			let ts = Date.now() - (res.headers.get('X-Sample-Age') || 0),
+				samples = data_decode(new DataView(await res.arrayBuffer()), ts)
+			data_cursor = res.headers.get('X-Cursor') || data_cursor
+			data_add(samples) })
+		.catch(err => console.log(`Data-poll ERROR: ${err}`))
+		.finally(() => window.setTimeout(poll, opts.poll_interval * 1000))
+	if (!urls.data_live || !window.EventSource)
+		{ window.setTimeout(poll, opts.poll_interval * 1000); break Poll }
+
+	// Server-Sent Events with samples pushed by device, falling back to polling on errors
+	let live = new EventSource(`${urls.data_live}?c=${data_cursor}`)
+	live.onmessage = ev => {
+		let buff = new Uint8Array(ev.data.match(/../g).map(h => parseInt(h, 16)))
+		data_cursor = ev.lastEventId || data_cursor
+		data_add(data_decode(new DataView(buff.buffer), Date.now())) }
+	live.onerror = ev => {
+		if (live.readyState !== EventSource.CLOSED) return // will reconnect
+		console.log('Data-live ERROR: connection failed, switching to polling')
+		window.setTimeout(poll, opts.poll_interval * 1000) }
+	live.addEventListener('reload', ev => {
+		live.close()
+		d3.select('#errors').append('li').text(
+			'Device restarted or missed too many samples, reload page to get all new data' ) })
+} // Poll
+
 })